@@ -0,0 +1,256 @@
+import argparse
+import itertools
+import json
+import re
+import sys
+from Chess import Engine, Perft, Search
+
+
+#Headless batch analysis: FEN lines or PGN games are read one record at a time from files or stdin and every
+#result is written out as one JSON line straight away, so memory stays flat however big the input is.
+
+PGN_TOKENS = re.compile(r"\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|[^\s{}();]+")
+MOVE_NUMBER = re.compile(r"^\d+\.+")
+SAN_MOVE = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+class AnalysisError(Exception):
+    pass
+
+
+#Sniffs the first line that isn't blank, PGN starts with a tag pair or a move number
+def detectFormat(lines):
+    lines = iter(lines)
+    for line in lines:
+        if line.strip():
+            text = line.lstrip()
+            fmt = "pgn" if text.startswith("[") or MOVE_NUMBER.match(text) else "fen"
+            return fmt, itertools.chain([line], lines)
+    return "fen", iter(())
+
+
+def readFens(lines):
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+#Yields (offset, tags, movetext) per game. A game ends when the next tag section starts or the input runs out.
+#Lines may be text or bytes, offset is where the game's first line starts counting from the offset given, in
+#bytes when the lines are, so an index can seek straight back to a game.
+def readGames(lines, offset=0):
+    start = None
+    tags = {}
+    movetext = []
+    for line in lines:
+        text = (line.decode("utf-8", "replace") if isinstance(line, bytes) else line).strip()
+        if text.startswith("[") and text.endswith("]"):
+            if movetext:
+                yield start, tags, " ".join(movetext)
+                start = None
+                tags = {}
+                movetext = []
+            if start is None:
+                start = offset
+            name, _, value = text[1:-1].partition(" ")
+            tags[name] = value.strip().strip('"')
+        elif text and not text.startswith("%"):
+            if start is None:
+                start = offset
+            movetext.append(text)
+        offset += len(line)
+    if tags or movetext:
+        yield start, tags, " ".join(movetext)
+
+
+#SAN moves of the main line, skipping comments, variations, NAGs, move numbers and the result
+def sanMoves(movetext):
+    depth = 0
+    for token in PGN_TOKENS.findall(movetext):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0 and token[0] not in "{;$":
+            token = MOVE_NUMBER.sub("", token)
+            if token and token not in RESULTS:
+                yield token
+
+
+def loadFen(fen):
+    try:
+        gs = Perft.setupPosition(fen)
+    except ValueError as e:
+        raise AnalysisError(str(e))
+    enemyKing = gs.bKingSq if gs.whiteTurn else gs.wKingSq
+    if gs.sqUnderAttack(enemyKing, Engine.BLACK if gs.whiteTurn else Engine.WHITE):
+        raise AnalysisError("side not to move is in check")
+    return gs
+
+
+#Legal move in moves matching a SAN string
+def findSanMove(gs, san, moves):
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kingSide = len(text) == 3
+        for move in moves:
+            if move.castleMove and (move.endIndex > move.startIndex) == kingSide:
+                return move
+        raise AnalysisError("illegal move " + san)
+    match = SAN_MOVE.match(text)
+    if match is None:
+        raise AnalysisError("unreadable move " + san)
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    pieceType = Engine.PIECE_TYPES[piece or "p"]
+    promotionType = Engine.PIECE_TYPES[promotion] if promotion else 0
+    end = Engine.Move.ranksToRows[target[1]] * 8 + Engine.Move.filesToCols[target[0]]
+    candidates = [move for move in moves if move.endIndex == end and move.movedCode & Engine.TYPE_MASK == pieceType
+                  and (fromFile is None or move.startCol == Engine.Move.filesToCols[fromFile])
+                  and (fromRank is None or move.startRow == Engine.Move.ranksToRows[fromRank])
+                  and move.promotionType == promotionType]
+    if len(candidates) != 1:
+        raise AnalysisError(("ambiguous move " if candidates else "illegal move ") + san)
+    return candidates[0]
+
+
+#SAN for a legal move, moves being every legal move of the position. Plays the move to see if it checks or mates.
+def moveToSan(gs, move, moves):
+    if move.castleMove:
+        san = "O-O" if move.endIndex > move.startIndex else "O-O-O"
+    else:
+        target = move.getRankFile(move.endRow, move.endCol)
+        capture = "x" if move.takenCode != Engine.EMPTY else ""
+        if move.movedCode & Engine.TYPE_MASK == Engine.PAWN:
+            san = (move.colsToFiles[move.startCol] + capture if capture else "") + target
+            if move.pawnPromotion:
+                san += "=" + move.pieceCreated[1]
+        else:
+            others = [other for other in moves if other.endIndex == move.endIndex and other.movedCode == move.movedCode
+                      and other.startIndex != move.startIndex]
+            origin = ""
+            if others:
+                if all(other.startCol != move.startCol for other in others):
+                    origin = move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in others):
+                    origin = move.rowsToRanks[move.startRow]
+                else:
+                    origin = move.getRankFile(move.startRow, move.startCol)
+            san = move.pieceMoved[1] + origin + capture + target
+    savedFlags = (gs.inCheck, gs.checkMate, gs.staleMate)
+    gs.makeMove(move)
+    replies = gs.getValidMoves()
+    if gs.inCheck:
+        san += "+" if replies else "#"
+    gs.unndoMove()
+    gs.inCheck, gs.checkMate, gs.staleMate = savedFlags
+    return san
+
+
+class Analyzer():
+    def __init__(self, searchTime=None, depth=None, hashMB=16):
+        self.searchTime = searchTime
+        self.depth = depth
+        self.searcher = Search.Searcher(hashMB) if searchTime is not None or depth is not None else None
+
+
+    #Legal move count, game over flags, static evaluation and optionally a search, all from the side to move
+    def analyzePosition(self, gs, record):
+        moves = gs.getValidMoves()
+        record["legalMoves"] = len(moves)
+        record["inCheck"] = gs.inCheck
+        record["checkMate"] = gs.checkMate
+        record["staleMate"] = gs.staleMate
+        record["eval"] = gs.evaluate()
+        if self.searcher is not None and moves:
+            result = self.searcher.search(gs, self.depth or Search.MAX_PLY, self.searchTime)
+            record["bestMove"] = result.bestMove.getChessNotation() if result.bestMove else None
+            record["score"] = result.score
+            record["depth"] = result.depth
+            record["nodes"] = result.nodes
+        return record
+
+
+    def analyzeFen(self, fen):
+        record = {"fen": fen}
+        try:
+            return self.analyzePosition(loadFen(fen), record)
+        except AnalysisError as e:
+            record["error"] = str(e)
+            return record
+        except Exception as e: #Anything else is an engine bug, report it and keep the stream going
+            record["error"] = repr(e)
+            return record
+
+
+    #Replays one game, yielding a record per position when perPosition is set and a summary record at the end
+    def analyzeGame(self, index, tags, movetext, perPosition=False):
+        summary = {"game": index, "white": tags.get("White"), "black": tags.get("Black"), "result": tags.get("Result")}
+        plies = 0
+        try:
+            gs = loadFen(tags.get("FEN", Engine.START_FEN))
+            for san in sanMoves(movetext):
+                if perPosition:
+                    yield self.analyzePosition(gs, {"game": index, "ply": plies, "fen": gs.getFen(), "move": san})
+                gs.makeMove(findSanMove(gs, san, gs.getValidMoves()))
+                plies += 1
+            summary["plies"] = plies
+            summary["fen"] = gs.getFen()
+            self.analyzePosition(gs, summary)
+        except AnalysisError as e:
+            summary["plies"] = plies
+            summary["error"] = str(e)
+        except Exception as e: #Anything else is an engine bug, report it and keep the stream going
+            summary["plies"] = plies
+            summary["error"] = repr(e)
+        yield summary
+
+
+    def run(self, lines, fmt="auto", perPosition=False, out=sys.stdout):
+        if fmt == "auto":
+            fmt, lines = detectFormat(lines)
+        count = 0
+        if fmt == "fen":
+            for fen in readFens(lines):
+                out.write(json.dumps(self.analyzeFen(fen)) + "\n")
+                count += 1
+        else:
+            for index, (offset, tags, movetext) in enumerate(readGames(lines)):
+                for record in self.analyzeGame(index, tags, movetext, perPosition):
+                    out.write(json.dumps(record) + "\n")
+                count += 1
+        out.flush()
+        return count
+
+
+#Every input as a stream of lines, "-" being stdin
+def inputLines(paths):
+    for path in paths:
+        if path == "-":
+            yield from sys.stdin
+        else:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield from f
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream FEN lines or PGN games through the engine, one JSON line per result")
+    parser.add_argument("inputs", nargs="*", default=["-"], help="Files to read, - for stdin (the default)")
+    parser.add_argument("--format", choices=("auto", "fen", "pgn"), default="auto")
+    parser.add_argument("--positions", action="store_true", help="For PGN, also write a record for every position played")
+    parser.add_argument("--time", type=float, help="Search each position for this many seconds")
+    parser.add_argument("--depth", type=int, help="Search each position to this depth")
+    parser.add_argument("--hash", type=int, default=16, help="Transposition table size in MB")
+    args = parser.parse_args(argv)
+
+    analyzer = Analyzer(args.time, args.depth, args.hash)
+    try:
+        analyzer.run(inputLines(args.inputs), args.format, args.positions)
+    except BrokenPipeError: #Output piped into head and closed early
+        sys.stderr.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,322 @@
+import argparse
+import random
+import time
+import numpy as np
+from Chess import Engine
+from Chess.Engine import (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, DIRECTIONS, OPPOSITE,
+                          KNIGHT_OFFSETS)
+
+
+#Attack maps, checks and move counts for many positions at once. Every position is a row of uint64 bitboards
+#(bit n is square n, row * 8 + col like GameState.squares) and each step is a shift or mask over the whole batch,
+#so there is no Python loop per position. Needs NumPy, which nothing else in the package does.
+#
+#Positions come in as an (N, 64) or (N, 8, 8) array of piece codes, with optional side to move, castling bits
+#(castleRights.toBits) and en passant squares (64 for none), or straight from GameStates with stackPositions.
+
+FULL = np.uint64((1 << 64) - 1)
+ZERO = np.uint64(0)
+LAST_ROWS = {WHITE: np.uint64(0xFF), BLACK: np.uint64(0xFF << 56)} #Where pawns promote
+PUSH_ROWS = {WHITE: np.uint64(0xFF << 40), BLACK: np.uint64(0xFF << 16)} #Where a pawn lands after one step from home
+PUSH_DIRECTIONS = {WHITE: 0, BLACK: 2}
+CAPTURE_DIRECTIONS = {WHITE: (4, 5), BLACK: (6, 7)}
+STRAIGHT = (0, 1, 2, 3)
+DIAGONAL = (4, 5, 6, 7)
+LINE = tuple(min(d, OPPOSITE[d]) for d in range(8)) #Both directions of a line share one index
+CASTLING = { #Castling bit, squares that must be empty, squares the king crosses that can't be attacked
+    WHITE: ((1, (61, 62), (61, 62)), (2, (59, 58, 57), (59, 58))),
+    BLACK: ((4, (5, 6), (5, 6)), (8, (3, 2, 1), (3, 2))),
+}
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _step(dRow, dCol):
+    #Source squares that stay on the board, and how far the index moves
+    mask = 0
+    for sq in range(64):
+        if 0 <= sq // 8 + dRow < 8 and 0 <= sq % 8 + dCol < 8:
+            mask |= 1 << sq
+    return np.uint64(mask), dRow * 8 + dCol
+
+
+DIRECTION_STEPS = tuple(_step(dRow, dCol) for dRow, dCol in DIRECTIONS)
+KNIGHT_STEPS = tuple(_step(dRow, dCol) for dRow, dCol in KNIGHT_OFFSETS)
+
+
+def shift(bb, step):
+    mask, delta = step
+    bb = bb & mask
+    return bb << np.uint64(delta) if delta > 0 else bb >> np.uint64(-delta)
+
+
+#Squares a slider on bb attacks in one direction, up to and including the first square that isn't empty
+def slide(bb, empty, step):
+    ray = np.zeros_like(bb)
+    for i in range(7):
+        bb = shift(bb, step)
+        ray |= bb
+        bb &= empty
+    return ray
+
+
+def popcount(bb):
+    if hasattr(np, "bitwise_count"): #NumPy 2.0 on
+        return np.bitwise_count(bb).astype(np.int64)
+    return POPCOUNT_TABLE[np.ascontiguousarray(bb, dtype="<u8").view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+
+#Counts moves to bb, four for each one that promotes
+def pawnCount(bb, color):
+    return popcount(bb & ~LAST_ROWS[color]) + 4 * popcount(bb & LAST_ROWS[color])
+
+
+def toSquares(bb):
+    return np.unpackbits(np.ascontiguousarray(bb, dtype="<u8").view(np.uint8).reshape(-1, 8), axis=1,
+                         bitorder="little").astype(bool)
+
+
+def fromSquares(squares):
+    return np.packbits(squares, axis=1, bitorder="little").view("<u8").ravel().astype(np.uint64)
+
+
+#(squares, whiteTurn, castling, enPassant) arrays for a list of GameStates, from their packed positions
+def stackPositions(states):
+    packed = np.frombuffer(b"".join(gs.packPosition() for gs in states), dtype=np.uint8).reshape(-1, 66)
+    return packed[:, :64], (packed[:, 64] & 1).astype(bool), packed[:, 64] >> 1, packed[:, 65]
+
+
+class Pieces():
+    def __init__(self, squares, color):
+        self.pawns, self.knights, self.bishops, self.rooks, self.queens, self.king = \
+            (fromSquares(squares == color | pieceType) for pieceType in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING))
+        self.all = self.pawns | self.knights | self.bishops | self.rooks | self.queens | self.king
+        self.color = color
+
+
+    def take(self, index):
+        taken = Pieces.__new__(Pieces)
+        for name in ("pawns", "knights", "bishops", "rooks", "queens", "king", "all"):
+            setattr(taken, name, getattr(self, name)[index])
+        taken.color = self.color
+        return taken
+
+
+    def sliders(self, direction):
+        return (self.rooks if direction < 4 else self.bishops) | self.queens
+
+
+def attackMap(pieces, occupied):
+    empty = ~occupied
+    attacked = np.zeros_like(occupied)
+    for d in CAPTURE_DIRECTIONS[pieces.color]:
+        attacked |= shift(pieces.pawns, DIRECTION_STEPS[d])
+    for step in KNIGHT_STEPS:
+        attacked |= shift(pieces.knights, step)
+    for d, step in enumerate(DIRECTION_STEPS):
+        attacked |= shift(pieces.king, step) | slide(pieces.sliders(d), empty, step)
+    return attacked
+
+
+#Pieces of enemy attacking the squares in target, pawns passed separately so en passant can lift one off
+def attackersTo(target, occupied, enemy, pawns):
+    empty = ~occupied
+    attackers = np.zeros_like(occupied)
+    for d in CAPTURE_DIRECTIONS[WHITE if enemy.color == BLACK else BLACK]:
+        attackers |= shift(target, DIRECTION_STEPS[d]) & pawns
+    for step in KNIGHT_STEPS:
+        attackers |= shift(target, step) & enemy.knights
+    for d, step in enumerate(DIRECTION_STEPS):
+        attackers |= slide(target, empty, step) & enemy.sliders(d)
+    return attackers
+
+
+#Pseudo-legal moves for pieces, ignoring checks, pins, castling and en passant
+def mobility(pieces, enemy):
+    occupied = pieces.all | enemy.all
+    empty = ~occupied
+    notOwn = ~pieces.all
+    color = pieces.color
+    pushStep = DIRECTION_STEPS[PUSH_DIRECTIONS[color]]
+    single = shift(pieces.pawns, pushStep) & empty
+    count = pawnCount(single, color) + popcount(shift(single & PUSH_ROWS[color], pushStep) & empty)
+    for d in CAPTURE_DIRECTIONS[color]:
+        count += pawnCount(shift(pieces.pawns, DIRECTION_STEPS[d]) & enemy.all, color)
+    for step in KNIGHT_STEPS:
+        count += popcount(shift(pieces.knights, step) & notOwn)
+    #Rays of different sliders along one direction never overlap, so counting the union counts every move
+    for d, step in enumerate(DIRECTION_STEPS):
+        count += popcount((slide(pieces.sliders(d), empty, step) | shift(pieces.king, step)) & notOwn)
+    return count
+
+
+#(legal move count, checker count) for the side pieces when it is to move
+def legalMoves(pieces, enemy, castling, enPassant):
+    occupied = pieces.all | enemy.all
+    empty = ~occupied
+    color = pieces.color
+    king = pieces.king
+    checkers = attackersTo(king, occupied, enemy, enemy.pawns)
+    checks = popcount(checkers)
+
+    #Non-king moves have to land on the checker or between it and the king, and can't happen at all in double check
+    checkMask = np.where(checks == 0, FULL, ZERO)
+    block = checkers.copy()
+    for step in DIRECTION_STEPS:
+        ray = slide(king, empty, step)
+        block |= np.where(ray & checkers != 0, ray, ZERO)
+    checkMask |= np.where(checks == 1, block, ZERO)
+
+    #A pinned piece may only move along the line of its pin
+    pinned = np.zeros_like(king)
+    pinLines = {}
+    for d, step in enumerate(DIRECTION_STEPS):
+        ray = slide(king, ~enemy.all, step) #Through our own pieces up to the first enemy one
+        own = ray & pieces.all
+        isPin = (ray & enemy.sliders(d) != 0) & (own != 0) & (own & (own - np.uint64(1)) == 0)
+        pinnedHere = np.where(isPin, own, ZERO)
+        pinned |= pinnedHere
+        pinLines[LINE[d]] = pinLines.get(LINE[d], ZERO) | pinnedHere
+    free = ~pinned
+
+    targets = ~pieces.all & checkMask
+    pushDirection = PUSH_DIRECTIONS[color]
+    pushStep = DIRECTION_STEPS[pushDirection]
+    single = shift(pieces.pawns & (free | pinLines[LINE[pushDirection]]), pushStep) & empty
+    count = pawnCount(single & checkMask, color)
+    count += popcount(shift(single & PUSH_ROWS[color], pushStep) & empty & checkMask)
+    for d in CAPTURE_DIRECTIONS[color]:
+        count += pawnCount(shift(pieces.pawns & (free | pinLines[LINE[d]]), DIRECTION_STEPS[d]) & enemy.all & checkMask,
+                           color)
+    for step in KNIGHT_STEPS:
+        count += popcount(shift(pieces.knights & free, step) & targets)
+    for d, step in enumerate(DIRECTION_STEPS):
+        count += popcount(slide(pieces.sliders(d) & (free | pinLines[LINE[d]]), empty, step) & targets)
+
+    #The king can't step back along a checking ray, so the enemy attacks are worked out without it
+    kingTargets = ~pieces.all & ~attackMap(enemy, occupied & ~king)
+    for step in DIRECTION_STEPS:
+        count += popcount(shift(king, step) & kingTargets)
+    attacked = attackMap(enemy, occupied)
+    for bit, between, crossed in CASTLING[color]:
+        clear = np.uint64(sum(1 << sq for sq in between))
+        safe = np.uint64(sum(1 << sq for sq in crossed))
+        count += ((castling & bit != 0) & (checks == 0) & (occupied & clear == 0) & (attacked & safe == 0)).astype(np.int64)
+
+    #En passant is settled by making it: lift both pawns off and see whether the king is attacked
+    target = np.where(enPassant < 64, np.uint64(1) << np.minimum(enPassant, 63).astype(np.uint64), ZERO)
+    captured = shift(target, DIRECTION_STEPS[OPPOSITE[pushDirection]]) & enemy.pawns
+    for d in CAPTURE_DIRECTIONS[color]:
+        capturer = shift(target, DIRECTION_STEPS[OPPOSITE[d]]) & pieces.pawns
+        after = occupied ^ capturer ^ target ^ captured
+        safe = attackersTo(king, after, enemy, enemy.pawns ^ captured) == 0
+        count += ((capturer != 0) & (captured != 0) & safe).astype(np.int64)
+    return count, checks
+
+
+#Everything for a batch, as arrays of length N: whiteAttacks/blackAttacks (uint64 bitboards), inCheck, checkers,
+#whiteMobility/blackMobility (pseudo-legal) and legalMoves for the side to move
+def analyzeBatch(squares, whiteTurn=None, castling=None, enPassant=None):
+    squares = np.asarray(squares, dtype=np.uint8).reshape(-1, 64)
+    n = len(squares)
+    whiteTurn = np.ones(n, dtype=bool) if whiteTurn is None else np.asarray(whiteTurn, dtype=bool)
+    castling = np.zeros(n, dtype=np.uint8) if castling is None else np.asarray(castling, dtype=np.uint8)
+    enPassant = np.full(n, 64, dtype=np.uint8) if enPassant is None else np.asarray(enPassant, dtype=np.uint8)
+    white = Pieces(squares, WHITE)
+    black = Pieces(squares, BLACK)
+    occupied = white.all | black.all
+
+    result = {"whiteAttacks": attackMap(white, occupied), "blackAttacks": attackMap(black, occupied),
+              "whiteMobility": mobility(white, black), "blackMobility": mobility(black, white),
+              "legalMoves": np.zeros(n, dtype=np.int64), "checkers": np.zeros(n, dtype=np.int64)}
+    for pieces, enemy, index in ((white, black, np.flatnonzero(whiteTurn)), (black, white, np.flatnonzero(~whiteTurn))):
+        if len(index):
+            count, checks = legalMoves(pieces.take(index), enemy.take(index), castling[index], enPassant[index])
+            result["legalMoves"][index] = count
+            result["checkers"][index] = checks
+    result["inCheck"] = result["checkers"] > 0
+    return result
+
+
+def analyzeStates(states):
+    return analyzeBatch(*stackPositions(states))
+
+
+#The same numbers from the scalar generator, one position at a time
+def scalarAnalysis(gs):
+    attacks = {}
+    for color, ally in ((WHITE, BLACK), (BLACK, WHITE)):
+        attacks[color] = sum(1 << sq for sq in range(64) if gs.sqUnderAttack(sq, ally))
+    mobility = {}
+    packed = gs.packPosition()
+    for color in (WHITE, BLACK):
+        plain = Engine.GameState()
+        plain.loadPackedPosition(packed[:64] + bytes((color == WHITE, 64))) #No castling or en passant
+        plain.pins = {}
+        plain.attacked = bytearray(64)
+        mobility[color] = len(plain.getPossibleMoves())
+    moves = gs.getValidMoves()
+    return {"whiteAttacks": attacks[WHITE], "blackAttacks": attacks[BLACK], "whiteMobility": mobility[WHITE],
+            "blackMobility": mobility[BLACK], "legalMoves": len(moves), "inCheck": gs.inCheck}
+
+
+#(index, field, batch value, scalar value) for every number that differs from the scalar generator
+def validate(states):
+    result = analyzeStates(states)
+    mismatches = []
+    for i, gs in enumerate(states):
+        for field, expected in scalarAnalysis(gs).items():
+            value = result[field][i].item()
+            if value != expected:
+                mismatches.append((i, field, value, expected))
+    return mismatches
+
+
+#GameStates reached by random games from the start and the perft positions
+def randomStates(count, seed=None, maxPlies=80):
+    from Chess.Perft import POSITIONS
+    rng = random.Random(seed)
+    starts = [fen for name, fen, expected in POSITIONS]
+    states = []
+    while len(states) < count:
+        gs = Engine.GameState(rng.choice(starts))
+        for ply in range(rng.randrange(maxPlies)):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+        states.append(Engine.GameState(gs.getFen()))
+    return states
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vectorized attack maps and move counts over a batch of positions")
+    parser.add_argument("--fens", help="File of FEN lines to use instead of random positions")
+    parser.add_argument("--count", type=int, default=2000, help="Number of random positions")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--validate", action="store_true", help="Check every number against the scalar generator")
+    args = parser.parse_args(argv)
+
+    if args.fens:
+        with open(args.fens) as f:
+            states = [Engine.GameState(line.strip()) for line in f if line.strip()]
+    else:
+        states = randomStates(args.count, args.seed)
+    positions = stackPositions(states)
+    start = time.perf_counter()
+    result = analyzeBatch(*positions)
+    elapsed = time.perf_counter() - start
+    print("%d positions in %.3fs, %.0f positions/s, %d legal moves, %d in check"
+          % (len(states), elapsed, len(states) / max(elapsed, 1e-9), result["legalMoves"].sum(), result["inCheck"].sum()))
+    if args.validate:
+        start = time.perf_counter()
+        mismatches = validate(states)
+        print("scalar check took %.3fs" % (time.perf_counter() - start))
+        for index, field, value, expected in mismatches[:20]:
+            print("%s  %s: batch %d, scalar %d" % (states[index].getFen(), field, value, expected))
+        print("%d mismatches" % len(mismatches))
+        return 1 if mismatches else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,293 @@
+from Chess.Engine import (EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, COLOR_MASK,
+                          EN_PASSANT_FLAG, PROMOTION_FLAG, CASTLE_FLAG, PROMOTION_TYPES, RAYS, KNIGHT_SQUARES, KING_SQUARES,
+                          getMove)
+
+#Bit n of a bitboard is square n of GameState.squares (row * 8 + col, a8 = 0, h1 = 63)
+FULL = (1 << 64) - 1
+BIT = tuple(1 << sq for sq in range(64))
+FILE_A = sum(BIT[row * 8] for row in range(8))
+FILE_H = sum(BIT[row * 8 + 7] for row in range(8))
+ROW_3 = sum(BIT[5 * 8 + col] for col in range(8)) #White pawns land here after one step from the start row
+ROW_6 = sum(BIT[2 * 8 + col] for col in range(8))
+ROW_1 = sum(BIT[7 * 8 + col] for col in range(8))
+ROW_8 = sum(BIT[col] for col in range(8))
+
+STRAIGHT = (0, 1, 2, 3)
+DIAGONAL = (4, 5, 6, 7)
+INCREASING = (False, False, True, True, False, False, True, True) #Directions whose squares grow away from the start
+
+
+def _mask(squares):
+    mask = 0
+    for sq in squares:
+        mask |= BIT[sq]
+    return mask
+
+
+RAY_MASKS = tuple(tuple(_mask(ray) for ray in RAYS[sq]) for sq in range(64))
+KNIGHT_ATTACKS = tuple(_mask(targets) for targets in KNIGHT_SQUARES)
+KING_ATTACKS = tuple(_mask(targets) for targets in KING_SQUARES)
+PAWN_ATTACKS = {
+    WHITE: tuple(_mask(RAYS[sq][4][:1]) | _mask(RAYS[sq][5][:1]) for sq in range(64)),
+    BLACK: tuple(_mask(RAYS[sq][6][:1]) | _mask(RAYS[sq][7][:1]) for sq in range(64)),
+}
+
+
+def _buildBetween():
+    between = [[0] * 64 for sq in range(64)]
+    for sq in range(64):
+        for ray in RAYS[sq]:
+            mask = 0
+            for target in ray:
+                between[sq][target] = mask
+                mask |= BIT[target]
+    return tuple(tuple(row) for row in between)
+
+
+BETWEEN = _buildBetween() #Squares strictly between two aligned squares, 0 otherwise
+
+
+def firstBlocker(direction, blockers):
+    if INCREASING[direction]:
+        return (blockers & -blockers).bit_length() - 1
+    return blockers.bit_length() - 1
+
+
+def slidingAttacks(sq, occupied, directions):
+    attacks = 0
+    rays = RAY_MASKS[sq]
+    for d in directions:
+        ray = rays[d]
+        blockers = ray & occupied
+        if blockers:
+            if INCREASING[d]:
+                ray ^= RAY_MASKS[(blockers & -blockers).bit_length() - 1][d]
+            else:
+                ray ^= RAY_MASKS[blockers.bit_length() - 1][d]
+        attacks |= ray
+    return attacks
+
+
+def iterBits(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+#Alternate move generator for a GameState, producing the same Move objects as the ray walking one. The
+#bitboards are kept in step with the board by makeMove and unndoMove, and only rebuilt when a position is loaded.
+class BitboardGenerator():
+    def __init__(self, gs):
+        self.gs = gs
+        self.pieces = [0] * 32 #Indexed by piece code, the bare color codes hold every square that side occupies
+        self.loadPieces()
+
+
+    def loadPieces(self):
+        pieces = [0] * 32
+        squares = self.gs.squares
+        for sq in range(64):
+            piece = squares[sq]
+            if piece != EMPTY:
+                pieces[piece] |= BIT[sq]
+                pieces[piece & COLOR_MASK] |= BIT[sq]
+        self.pieces = pieces
+
+
+    #Toggles the squares a move changes. XOR undoes itself, so making and taking back a move both come here.
+    def applyMove(self, move):
+        pieces = self.pieces
+        start, end = move.startIndex, move.endIndex
+        moved = move.movedCode
+        color = moved & COLOR_MASK
+        fromTo = BIT[start] | BIT[end]
+        pieces[color] ^= fromTo
+        if move.pawnPromotion:
+            pieces[moved] ^= BIT[start]
+            pieces[color | move.promotionType] ^= BIT[end]
+        else:
+            pieces[moved] ^= fromTo
+        taken = move.takenCode
+        if taken != EMPTY:
+            takenBit = BIT[start & ~7 | end & 7] if move.enPassant else BIT[end]
+            pieces[taken] ^= takenBit
+            pieces[taken & COLOR_MASK] ^= takenBit
+        elif move.castleMove:
+            rookSquares = BIT[end + 1] | BIT[end - 1] if end - start == 2 else BIT[end - 2] | BIT[end + 1]
+            pieces[color | ROOK] ^= rookSquares
+            pieces[color] ^= rookSquares
+
+
+    def attackersTo(self, sq, occupied, color):
+        pieces = self.pieces
+        enemy = BLACK if color == WHITE else WHITE
+        queens = pieces[color | QUEEN]
+        return (KNIGHT_ATTACKS[sq] & pieces[color | KNIGHT]) | \
+               (KING_ATTACKS[sq] & pieces[color | KING]) | \
+               (PAWN_ATTACKS[enemy][sq] & pieces[color | PAWN]) | \
+               (slidingAttacks(sq, occupied, STRAIGHT) & (pieces[color | ROOK] | queens)) | \
+               (slidingAttacks(sq, occupied, DIAGONAL) & (pieces[color | BISHOP] | queens))
+
+
+    def attackedBy(self, color, occupied):
+        pieces = self.pieces
+        pawns = pieces[color | PAWN]
+        if color == WHITE:
+            attacked = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        else:
+            attacked = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL
+        for sq in iterBits(pieces[color | KNIGHT]):
+            attacked |= KNIGHT_ATTACKS[sq]
+        for sq in iterBits(pieces[color | KING]):
+            attacked |= KING_ATTACKS[sq]
+        queens = pieces[color | QUEEN]
+        for sq in iterBits(pieces[color | ROOK] | queens):
+            attacked |= slidingAttacks(sq, occupied, STRAIGHT)
+        for sq in iterBits(pieces[color | BISHOP] | queens):
+            attacked |= slidingAttacks(sq, occupied, DIAGONAL)
+        return attacked
+
+
+    def getValidMoves(self):
+        gs = self.gs
+        pieces = self.pieces
+        squares = gs.squares
+        moves = []
+        us = WHITE if gs.whiteTurn else BLACK
+        them = BLACK if us == WHITE else WHITE
+        ours = pieces[us]
+        theirs = pieces[them]
+        occupied = ours | theirs
+        kingSq = gs.wKingSq if us == WHITE else gs.bKingSq
+        targets = ~ours & FULL
+
+        checkers = self.attackersTo(kingSq, occupied, them)
+        gs.inCheck = checkers != 0
+        #The king is taken off the board so it can't hide behind itself along a checking ray
+        attacked = self.attackedBy(them, occupied ^ BIT[kingSq])
+        for sq in iterBits(KING_ATTACKS[kingSq] & targets & ~attacked):
+            moves.append(getMove(kingSq, sq, squares))
+        if checkers & (checkers - 1): #Double check, only the king can move
+            return moves
+
+        if checkers:
+            checkSq = checkers.bit_length() - 1
+            checkMask = BETWEEN[kingSq][checkSq] | checkers
+        else:
+            checkMask = FULL
+            self.addCastleMoves(kingSq, occupied, attacked, moves)
+
+        #A pinned piece may only move between its king and the pinner, or capture the pinner
+        pins = {}
+        queens = pieces[them | QUEEN]
+        pinners = (queens | pieces[them | ROOK], queens | pieces[them | BISHOP])
+        kingRays = RAY_MASKS[kingSq]
+        for d in range(8):
+            sliders = pinners[d >= 4]
+            if not kingRays[d] & sliders: #Nothing on this ray could pin
+                continue
+            blockers = kingRays[d] & occupied
+            first = firstBlocker(d, blockers)
+            if BIT[first] & ours:
+                rest = blockers ^ BIT[first]
+                if rest:
+                    second = firstBlocker(d, rest)
+                    if BIT[second] & sliders:
+                        pins[first] = BETWEEN[kingSq][second] | BIT[second]
+        pinned = _mask(pins)
+
+        #The target loops are iterBits written out, a generator per piece costs more than the moves it yields
+        for sq in iterBits(pieces[us | KNIGHT] & ~pinned):
+            bb = KNIGHT_ATTACKS[sq] & targets & checkMask
+            while bb:
+                low = bb & -bb
+                moves.append(getMove(sq, low.bit_length() - 1, squares))
+                bb ^= low
+        for pieceType, directions in ((BISHOP, DIAGONAL), (ROOK, STRAIGHT), (QUEEN, STRAIGHT + DIAGONAL)):
+            for sq in iterBits(pieces[us | pieceType]):
+                bb = slidingAttacks(sq, occupied, directions) & targets & checkMask & pins.get(sq, FULL)
+                while bb:
+                    low = bb & -bb
+                    moves.append(getMove(sq, low.bit_length() - 1, squares))
+                    bb ^= low
+
+        self.addPawnMoves(us, them, kingSq, occupied, checkMask, pins, pinned, moves)
+        return moves
+
+
+    def addPawnMoves(self, us, them, kingSq, occupied, checkMask, pins, pinned, moves):
+        gs = self.gs
+        squares = gs.squares
+        pawns = self.pieces[us | PAWN]
+        theirs = self.pieces[them]
+        empty = ~occupied & FULL
+        free = pawns & ~pinned
+        if us == WHITE:
+            single = (free >> 8) & empty
+            double = ((single & ROW_3) >> 8) & empty
+            left = ((free & ~FILE_A) >> 9) & theirs
+            right = ((free & ~FILE_H) >> 7) & theirs
+            shifts = ((single, 8), (double, 16), (left, 9), (right, 7))
+            lastRow = ROW_8
+        else:
+            single = (free << 8) & empty
+            double = ((single & ROW_6) << 8) & empty
+            left = ((free & ~FILE_A) << 7) & theirs
+            right = ((free & ~FILE_H) << 9) & theirs
+            shifts = ((single, -8), (double, -16), (left, -7), (right, -9))
+            lastRow = ROW_1
+        for landed, delta in shifts:
+            bb = landed & checkMask
+            while bb:
+                low = bb & -bb
+                target = low.bit_length() - 1
+                if low & lastRow:
+                    for promotion in PROMOTION_TYPES:
+                        moves.append(getMove(target + delta, target, squares, PROMOTION_FLAG, promotion))
+                else:
+                    moves.append(getMove(target + delta, target, squares))
+                bb ^= low
+
+        forward = -8 if us == WHITE else 8
+        startRow = 6 if us == WHITE else 1
+        for sq in iterBits(pawns & pinned):
+            allowed = checkMask & pins[sq]
+            reachable = PAWN_ATTACKS[us][sq] & theirs
+            if BIT[sq + forward] & empty:
+                reachable |= BIT[sq + forward]
+                if sq // 8 == startRow and BIT[sq + 2 * forward] & empty:
+                    reachable |= BIT[sq + 2 * forward]
+            for target in iterBits(reachable & allowed):
+                if BIT[target] & (ROW_8 | ROW_1):
+                    for promotion in PROMOTION_TYPES:
+                        moves.append(getMove(sq, target, squares, PROMOTION_FLAG, promotion))
+                else:
+                    moves.append(getMove(sq, target, squares))
+
+        if gs.enPassantSq != ():
+            epSq = gs.enPassantSq[0] * 8 + gs.enPassantSq[1]
+            capturedSq = epSq - forward
+            for sq in iterBits(PAWN_ATTACKS[them][epSq] & pawns):
+                #Play it out on the occupancy and make sure nothing now reaches the king
+                after = (occupied ^ BIT[sq] ^ BIT[capturedSq]) | BIT[epSq]
+                self.pieces[them | PAWN] ^= BIT[capturedSq]
+                exposed = self.attackersTo(kingSq, after, them)
+                self.pieces[them | PAWN] ^= BIT[capturedSq]
+                if not exposed:
+                    moves.append(getMove(sq, epSq, squares, EN_PASSANT_FLAG))
+
+
+    def addCastleMoves(self, kingSq, occupied, attacked, moves):
+        gs = self.gs
+        rights = gs.currCastlingRights
+        if gs.whiteTurn:
+            kingSide, queenSide = rights.wKS, rights.wQS
+        else:
+            kingSide, queenSide = rights.bKS, rights.bQS
+        if kingSide and not (occupied & (BIT[kingSq + 1] | BIT[kingSq + 2])) \
+                and not (attacked & (BIT[kingSq + 1] | BIT[kingSq + 2])):
+            moves.append(getMove(kingSq, kingSq + 2, gs.squares, CASTLE_FLAG))
+        if queenSide and not (occupied & (BIT[kingSq - 1] | BIT[kingSq - 2] | BIT[kingSq - 3])) \
+                and not (attacked & (BIT[kingSq - 1] | BIT[kingSq - 2])):
+            moves.append(getMove(kingSq, kingSq - 2, gs.squares, CASTLE_FLAG))
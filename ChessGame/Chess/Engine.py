@@ -1,161 +1,559 @@
+import os
+import random
+from collections import OrderedDict
+from Chess import Evaluation
+
+
+#Pieces are stored as small ints: the low 3 bits hold the piece type and bits 3/4 the color
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE = 8
+BLACK = 16
+TYPE_MASK = 7
+COLOR_MASK = WHITE | BLACK
+
+PIECE_TYPES = {'p': PAWN, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING}
+PIECE_CODES = {"--": EMPTY}
+for _letter, _type in PIECE_TYPES.items():
+    PIECE_CODES["w" + _letter] = WHITE | _type
+    PIECE_CODES["b" + _letter] = BLACK | _type
+PIECE_NAMES = ["--"] * 32
+for _name, _code in PIECE_CODES.items():
+    PIECE_NAMES[_code] = _name
+PIECE_NAMES = tuple(PIECE_NAMES)
+
+#Squares are indexed row * 8 + col, row 0 being black's back rank like the old 8x8 board
+SQUARE_COORDS = tuple((sq // 8, sq % 8) for sq in range(64))
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)) #4 straight then 4 diagonal
+OPPOSITE = (2, 3, 0, 1, 7, 6, 5, 4) #Index of the reverse of each direction
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+
+def _buildRays():
+    rays = []
+    for row, col in SQUARE_COORDS:
+        squareRays = []
+        for dRow, dCol in DIRECTIONS:
+            ray = []
+            r, c = row + dRow, col + dCol
+            while 0 <= r < 8 and 0 <= c < 8:
+                ray.append(r * 8 + c)
+                r, c = r + dRow, c + dCol
+            squareRays.append(tuple(ray))
+        rays.append(tuple(squareRays))
+    return tuple(rays)
+
+
+def _buildJumps(offsets):
+    jumps = []
+    for row, col in SQUARE_COORDS:
+        jumps.append(tuple((row + dRow) * 8 + col + dCol for dRow, dCol in offsets
+                           if 0 <= row + dRow < 8 and 0 <= col + dCol < 8))
+    return tuple(jumps)
+
+
+#Precomputed per square so the generator never has to bounds check
+RAYS = _buildRays() #RAYS[sq][direction] lists the squares outward from sq
+KNIGHT_SQUARES = _buildJumps(KNIGHT_OFFSETS)
+KING_SQUARES = _buildJumps(DIRECTIONS)
+SLIDER_DIRECTIONS = {BISHOP: (4, 5, 6, 7), ROOK: (0, 2, 1, 3), QUEEN: (0, 2, 1, 3, 4, 5, 6, 7)}
+PAWN_CAPTURES = {WHITE: tuple(RAYS[sq][4][:1] + RAYS[sq][5][:1] for sq in range(64)), #Squares a pawn on sq attacks
+                 BLACK: tuple(RAYS[sq][6][:1] + RAYS[sq][7][:1] for sq in range(64))}
+
+#Zobrist keys, fixed seed so position keys are stable between runs and processes
+_zobristRandom = random.Random(0x5EED)
+PIECE_KEYS = tuple(tuple(_zobristRandom.getrandbits(64) if PIECE_NAMES[code] != "--" else 0 for sq in range(64))
+                   for code in range(32)) #PIECE_KEYS[pieceCode][sq]
+SIDE_KEY = _zobristRandom.getrandbits(64) #Mixed in when black is to move
+CASTLE_KEYS = tuple(_zobristRandom.getrandbits(64) for bit in range(4)) #wKS, wQS, bKS, bQS
+CASTLING_KEYS = [0] * 16 #Indexed by the castling bits of castleRights.toBits()
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights >> _bit & 1:
+            CASTLING_KEYS[_rights] ^= CASTLE_KEYS[_bit]
+CASTLING_KEYS = tuple(CASTLING_KEYS)
+EN_PASSANT_KEYS = tuple(_zobristRandom.getrandbits(64) for col in range(8)) #By file of the en passant square
+
+#Incremental evaluation tables: MG_SCORES[pieceCode][sq] is material plus square bonus, white positive
+MG_SCORES = [(0,) * 64] * 32
+EG_SCORES = [(0,) * 64] * 32
+PHASE = [0] * 32
+for _letter, _type in PIECE_TYPES.items():
+    for _color in (WHITE, BLACK):
+        MG_SCORES[_color | _type] = Evaluation.squareScores(_letter, _color == WHITE, Evaluation.MG_TABLES, Evaluation.MG_VALUES)
+        EG_SCORES[_color | _type] = Evaluation.squareScores(_letter, _color == WHITE, Evaluation.EG_TABLES, Evaluation.EG_VALUES)
+        PHASE[_color | _type] = Evaluation.PHASE_WEIGHTS[_letter]
+MG_SCORES = tuple(MG_SCORES)
+EG_SCORES = tuple(EG_SCORES)
+PHASE = tuple(PHASE)
+
+#Move flags, bits 12 to 14 of a packed move
+EN_PASSANT_FLAG, PROMOTION_FLAG, CASTLE_FLAG = 1, 2, 4
+PROMOTION_TYPES = (QUEEN, KNIGHT, ROOK, BISHOP) #One move per promotion piece, best first
+MOVE_POOL_LIMIT = 1 << 17 #The pool is dropped and refilled past this many distinct moves
+MOVE_POOL = {} #Packed move -> Move. Moves never change once built, so every position shares one instance
+
+
+#Start square, end square, flags, moved piece code, taken piece code and promotion piece type in one 28 bit int
+def packMove(start, end, moved, taken, flags=0, promotion=0):
+    return start | end << 6 | flags << 12 | moved << 15 | taken << 20 | promotion << 25
+
+
+#Pooled Move for the piece on start going to end, what the generators use instead of calling Move()
+def getMove(start, end, squares, flags=0, promotion=0):
+    moved = squares[start]
+    if flags & EN_PASSANT_FLAG:
+        taken = PAWN | (moved & COLOR_MASK ^ COLOR_MASK)
+    else:
+        taken = squares[end]
+    packed = start | end << 6 | flags << 12 | moved << 15 | taken << 20 | promotion << 25
+    move = MOVE_POOL.get(packed)
+    if move is None:
+        if len(MOVE_POOL) >= MOVE_POOL_LIMIT:
+            MOVE_POOL.clear()
+        move = MOVE_POOL[packed] = Move.fromPacked(packed)
+    return move
+
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_CODES = {} #FEN piece letter -> piece code, upper case for white
+for _letter, _type in zip("pnbrqk", (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)):
+    FEN_CODES[_letter.upper()] = WHITE | _type
+    FEN_CODES[_letter] = BLACK | _type
+FEN_LETTERS = {_code: _letter for _letter, _code in FEN_CODES.items()}
+
+START_BOARD = [
+    ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
+    ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
+    ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
+]
+
+
 class GameState():
-    def __init__(self):
-        self.board = [
-            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
-            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
-        ]
-
-        self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves
-                              , 'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
+    def __init__(self, fen=None):
+        self.squares = bytearray(PIECE_CODES[piece] for row in START_BOARD for piece in row)
+        self.board = BoardView(self.squares) #board[row][col] still reads and writes "wK"/"--" strings
+
+        self.moveFunctions = {PAWN: self.getPawnMoves, ROOK: self.getRookMoves, KNIGHT: self.getKnightMoves
+                              , BISHOP: self.getBishopMoves, QUEEN: self.getQueenMoves, KING: self.getKingMoves}
         self.whiteTurn = True
         self.moveLog = [] #Log to make undo's possible
-        self.wKingLocation = (7, 4)
-        self.bKingLocation = (0, 4)
+        self.wKingSq = 60
+        self.bKingSq = 4
         self.inCheck = False
         self.checkMate = False
         self.staleMate = False
-        self.pins = [] #Keeps track of pieces that are pinned and cannot be moved or else result in checkmate
+        self.pins = {} #Pinned square -> direction from the king, those pieces can only move along the pin
         self.checks = []
+        self.attacked = bytearray(64) #Squares the side not to move attacks, rebuilt once per getValidMoves
         self.enPassantSq = ()
         self.currCastlingRights = castleRights(True, True, True, True)
-        self.castleRightsLog = [castleRights(self.currCastlingRights.wKS, self.currCastlingRights.wQS, self.currCastlingRights.bKS, self.currCastlingRights.bQS,)]
+        self.halfmoveClock = 0 #Plies since the last capture or pawn move
+        self.fullmoveNumber = 1 #Goes up after every black move, like the last FEN field
+        self.zobristKey = self.computeHash() #64 bit position key, updated incrementally by makeMove
+        self.mgScore, self.egScore, self.phase = self.computeEvaluation() #Kept up to date by makeMove
+        #One tuple per move in moveLog with the state from before it that the move itself can't give back:
+        #(castling bits, en passant square, halfmove clock, zobrist key, mg score, eg score, phase)
+        self.stateLog = []
+        self.moveCache = None #Optional MoveCache, see enableMoveCache
+        self.bitboardGenerator = None #Set through setGenerator("bitboard") to swap out the ray walking generator
+        if fen is not None:
+            self.loadFen(fen)
+
+
+    @property
+    def wKingLocation(self):
+        return SQUARE_COORDS[self.wKingSq]
+
+    @wKingLocation.setter
+    def wKingLocation(self, location):
+        self.wKingSq = location[0] * 8 + location[1]
+
+    @property
+    def bKingLocation(self):
+        return SQUARE_COORDS[self.bKingSq]
+
+    @bKingLocation.setter
+    def bKingLocation(self, location):
+        self.bKingSq = location[0] * 8 + location[1]
+
+
+    #Selects the move generator behind getValidMoves, "mailbox" (default) or "bitboard"
+    def setGenerator(self, name):
+        if name == "bitboard":
+            from Chess import Bitboard
+            self.bitboardGenerator = Bitboard.BitboardGenerator(self)
+        elif name == "mailbox":
+            self.bitboardGenerator = None
+        else:
+            raise ValueError("Unknown move generator: " + name)
+
+
+    #Full rehash of the position, only needed after the board is set up by hand
+    def computeHash(self):
+        key = 0
+        for sq in range(64):
+            key ^= PIECE_KEYS[self.squares[sq]][sq]
+        if not self.whiteTurn:
+            key ^= SIDE_KEY
+        key ^= CASTLING_KEYS[self.currCastlingRights.toBits()]
+        if self.enPassantSq != ():
+            key ^= EN_PASSANT_KEYS[self.enPassantSq[1]]
+        return key
+
+
+    def refreshHash(self):
+        self.zobristKey = self.computeHash()
+
+
+    #Whether a pawn of the side to move stands next to the pawn that just moved two squares, pins aside
+    def enPassantCapturable(self):
+        if self.enPassantSq == ():
+            return False
+        row, col = self.enPassantSq
+        pawnRow = row + 1 if self.whiteTurn else row - 1
+        pawn = (WHITE if self.whiteTurn else BLACK) | PAWN
+        return (col > 0 and self.squares[pawnRow * 8 + col - 1] == pawn) or (col < 7 and self.squares[pawnRow * 8 + col + 1] == pawn)
+
+
+    #Middlegame score, endgame score (both from white's side) and phase, from scratch
+    def computeEvaluation(self):
+        mg = eg = phase = 0
+        for sq in range(64):
+            piece = self.squares[sq]
+            mg += MG_SCORES[piece][sq]
+            eg += EG_SCORES[piece][sq]
+            phase += PHASE[piece]
+        return mg, eg, phase
+
+
+    def refreshEvaluation(self):
+        self.mgScore, self.egScore, self.phase = self.computeEvaluation()
+
+
+    #Tapered static evaluation in centipawns for the side to move
+    def evaluate(self):
+        phase = min(self.phase, Evaluation.MAX_PHASE)
+        score = (self.mgScore * phase + self.egScore * (Evaluation.MAX_PHASE - phase)) // Evaluation.MAX_PHASE
+        return score if self.whiteTurn else -score
+
+
+    #Makes the current position the root: clears the undo logs and rebuilds the hash and evaluation.
+    #Call after setting up a position by hand.
+    def resetHistory(self):
+        self.moveLog = []
+        self.stateLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.refreshHash()
+        self.refreshEvaluation()
+        if self.bitboardGenerator is not None:
+            self.bitboardGenerator.loadPieces()
+
+
+    #66 byte snapshot of the position (squares, side and castling bits, en passant square) for shipping to
+    #other processes, instead of pickling the whole GameState with its logs and bound move functions
+    def packPosition(self):
+        ep = self.enPassantSq[0] * 8 + self.enPassantSq[1] if self.enPassantSq != () else 64
+        return bytes(self.squares) + bytes((self.whiteTurn | self.currCastlingRights.toBits() << 1, ep))
+
+
+    def loadPackedPosition(self, data):
+        self.squares[:] = data[:64]
+        self.whiteTurn = bool(data[64] & 1)
+        self.currCastlingRights = castleRights.fromBits(data[64] >> 1)
+        self.enPassantSq = SQUARE_COORDS[data[65]] if data[65] < 64 else ()
+        self.wKingSq = self.squares.find(WHITE | KING)
+        self.bKingSq = self.squares.find(BLACK | KING)
+        self.resetHistory()
+
+
+    #Sets up the position from a FEN string in one go, no moves get replayed. Raises ValueError if it can't be read.
+    def loadFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 2:
+            raise ValueError("FEN needs at least the board and the side to move: " + fen)
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError("FEN board needs 8 rows: " + fields[0])
+        squares = bytearray(64)
+        for row, text in enumerate(rows):
+            col = 0
+            for c in text:
+                if c in "12345678":
+                    col += int(c)
+                elif c in FEN_CODES and col < 8:
+                    squares[row * 8 + col] = FEN_CODES[c]
+                    col += 1
+                else:
+                    raise ValueError("Bad FEN row: " + text)
+            if col != 8:
+                raise ValueError("FEN row doesn't cover 8 squares: " + text)
+        if any(squares[sq] & TYPE_MASK == PAWN for sq in list(range(8)) + list(range(56, 64))):
+            raise ValueError("FEN has a pawn on the first or last rank: " + fields[0])
+        if squares.count(WHITE | KING) != 1 or squares.count(BLACK | KING) != 1:
+            raise ValueError("FEN needs exactly one king per side: " + fields[0])
+        if fields[1] not in ("w", "b"):
+            raise ValueError("FEN side to move must be w or b: " + fields[1])
+        castling = fields[2] if len(fields) > 2 else "-"
+        if castling != "-" and not set(castling) <= set("KQkq"):
+            raise ValueError("Bad FEN castling field: " + castling)
+        enPassant = fields[3] if len(fields) > 3 else "-"
+        if enPassant != "-" and (len(enPassant) != 2 or enPassant[0] not in "abcdefgh" or enPassant[1] not in "36"):
+            raise ValueError("Bad FEN en passant square: " + enPassant)
+        if enPassant != "-":
+            #The pawn that just moved two squares has to be standing in front of the square, on the right side's rank
+            rank, pawnRow, pawn = ("6", 3, BLACK | PAWN) if fields[1] == "w" else ("3", 4, WHITE | PAWN)
+            if enPassant[1] != rank or squares[pawnRow * 8 + "abcdefgh".index(enPassant[0])] != pawn:
+                raise ValueError("FEN en passant square has no pawn that just moved past it: " + enPassant)
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        except ValueError:
+            raise ValueError("Bad FEN halfmove clock: " + fields[4])
+        try:
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("Bad FEN fullmove number: " + fields[5])
+
+        self.squares[:] = squares #Same bytearray, so the board view keeps working
+        self.whiteTurn = fields[1] == "w"
+        self.wKingSq = squares.find(WHITE | KING)
+        self.bKingSq = squares.find(BLACK | KING)
+        #Rights the king and rook aren't at home for anymore are dropped rather than trusted
+        self.currCastlingRights = castleRights(
+            "K" in castling and squares[60] == WHITE | KING and squares[63] == WHITE | ROOK,
+            "k" in castling and squares[4] == BLACK | KING and squares[7] == BLACK | ROOK,
+            "Q" in castling and squares[60] == WHITE | KING and squares[56] == WHITE | ROOK,
+            "q" in castling and squares[4] == BLACK | KING and squares[0] == BLACK | ROOK)
+        if enPassant != "-":
+            self.enPassantSq = (Move.ranksToRows[enPassant[1]], Move.filesToCols[enPassant[0]])
+        else:
+            self.enPassantSq = ()
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.inCheck = False
+        self.resetHistory()
+
+
+    def getFen(self):
+        rows = []
+        for row in range(8):
+            text = ""
+            empty = 0
+            for piece in self.squares[row * 8:row * 8 + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += FEN_LETTERS[piece]
+            rows.append(text + str(empty) if empty else text)
+        rights = self.currCastlingRights
+        castling = ("K" if rights.wKS else "") + ("Q" if rights.wQS else "") + ("k" if rights.bKS else "") + ("q" if rights.bQS else "")
+        if self.enPassantSq != ():
+            row, col = self.enPassantSq
+            enPassant = Move.colsToFiles[col] + Move.rowsToRanks[row]
+        else:
+            enPassant = "-"
+        return " ".join(("/".join(rows), "w" if self.whiteTurn else "b", castling or "-", enPassant,
+                         str(self.halfmoveClock), str(self.fullmoveNumber)))
 
 
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        squares = self.squares
+        oldRights = self.currCastlingRights.toBits()
+        oldEnPassant = self.enPassantSq
+        self.stateLog.append((oldRights, oldEnPassant, self.halfmoveClock, self.zobristKey, self.mgScore, self.egScore, self.phase))
+        squares[move.startIndex] = EMPTY
+        squares[move.endIndex] = move.movedCode
         self.moveLog.append(move)
         self.whiteTurn = not self.whiteTurn #Switch turns every move
+        if self.whiteTurn:
+            self.fullmoveNumber += 1
+        pieceType = move.movedCode & TYPE_MASK
+        if pieceType == PAWN or move.takenCode != EMPTY:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
         #Keep track of both kings position for checkmate purposes
-        if move.pieceMoved == "wK":
-            self.wKingLocation = (move.endRow, move.endCol)
-        if move.pieceMoved == "bK":
-            self.bKingLocation = (move.endRow, move.endCol)
+        if pieceType == KING:
+            if move.movedCode & WHITE:
+                self.wKingSq = move.endIndex
+            else:
+                self.bKingSq = move.endIndex
         #Enpassant move
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-            self.enPassantSq = ((move.endRow + move.startRow)//2, move.endCol)
+        if pieceType == PAWN and abs(move.startIndex - move.endIndex) == 16:
+            self.enPassantSq = SQUARE_COORDS[(move.startIndex + move.endIndex) // 2]
         else:
             self.enPassantSq = ()
         if move.enPassant:
-            self.board[move.startRow][move.endCol] = "--"
+            squares[move.startIndex & ~7 | move.endIndex & 7] = EMPTY
         #PawnPromotion move
         if move.pawnPromotion:
-            promotionChoice = input("Promote to Q, R, B, or N:")
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + promotionChoice.upper()
+            squares[move.endIndex] = (move.movedCode & COLOR_MASK) | move.promotionType
 
         #Castling
         self.updateCastleRights(move)
-        self.castleRightsLog.append(castleRights(self.currCastlingRights.wKS, self.currCastlingRights.wQS, self.currCastlingRights.bKS, self.currCastlingRights.bQS,))
 
         if move.castleMove:
-            if move.endCol - move.startCol == 2:
-                self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][move.endCol + 1]
-                self.board[move.endRow][move.endCol + 1] = '--'
+            if move.endIndex - move.startIndex == 2:
+                squares[move.endIndex - 1] = squares[move.endIndex + 1]
+                squares[move.endIndex + 1] = EMPTY
+            else:
+                squares[move.endIndex + 1] = squares[move.endIndex - 2]
+                squares[move.endIndex - 2] = EMPTY
+
+        #Zobrist key and evaluation updates, only for the squares that changed
+        start, end = move.startIndex, move.endIndex
+        moved, placed, taken = move.movedCode, squares[end], move.takenCode #placed differs on promotion
+        takenSq = start & ~7 | end & 7 if move.enPassant else end
+        key = self.zobristKey ^ SIDE_KEY
+        key ^= PIECE_KEYS[moved][start] ^ PIECE_KEYS[placed][end] ^ PIECE_KEYS[taken][takenSq]
+        mg = self.mgScore - MG_SCORES[moved][start] + MG_SCORES[placed][end] - MG_SCORES[taken][takenSq]
+        eg = self.egScore - EG_SCORES[moved][start] + EG_SCORES[placed][end] - EG_SCORES[taken][takenSq]
+        phase = self.phase - PHASE[moved] + PHASE[placed] - PHASE[taken]
+        if move.castleMove:
+            rook = moved & COLOR_MASK | ROOK
+            if end - start == 2:
+                rookFrom, rookTo = end + 1, end - 1
             else:
-                self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2]
-                self.board[move.endRow][move.endCol - 2] = '--'
+                rookFrom, rookTo = end - 2, end + 1
+            key ^= PIECE_KEYS[rook][rookFrom] ^ PIECE_KEYS[rook][rookTo]
+            mg += MG_SCORES[rook][rookTo] - MG_SCORES[rook][rookFrom]
+            eg += EG_SCORES[rook][rookTo] - EG_SCORES[rook][rookFrom]
+        self.mgScore, self.egScore, self.phase = mg, eg, phase
+        key ^= CASTLING_KEYS[oldRights] ^ CASTLING_KEYS[self.currCastlingRights.toBits()]
+        if oldEnPassant != ():
+            key ^= EN_PASSANT_KEYS[oldEnPassant[1]]
+        if self.enPassantSq != ():
+            key ^= EN_PASSANT_KEYS[self.enPassantSq[1]]
+        self.zobristKey = key
+        if self.bitboardGenerator is not None:
+            self.bitboardGenerator.applyMove(move)
 
 
     def unndoMove(self):
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceTaken
+            squares = self.squares
+            squares[move.startIndex] = move.movedCode
+            squares[move.endIndex] = move.takenCode
             self.whiteTurn = not self.whiteTurn
+            if not self.whiteTurn:
+                self.fullmoveNumber -= 1
 
-            if move.pieceMoved == "wK":
-                self.wKingLocation = (move.endRow, move.endCol)
-            if move.pieceMoved == "bK":
-                self.bKingLocation = (move.endRow, move.endCol)
+            if move.movedCode & TYPE_MASK == KING:
+                if move.movedCode & WHITE:
+                    self.wKingSq = move.startIndex
+                else:
+                    self.bKingSq = move.startIndex
 
             if move.enPassant:
-                self.board[move.endRow][move.endCol] = "--"
-                self.board[move.startRow][move.endCol] = move.pieceTaken
-                self.enPassantSq = (move.endRow, move.endCol)
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.enPassantSq = ()
-
-
-
-            self.castleRightsLog.pop()
-            nRights = self.castleRightsLog[-1]
-            self.currCastlingRights.wKS = nRights.wKS
-            self.currCastlingRights.wQS = nRights.wQS
-            self.currCastlingRights.bKS = nRights.bKS
-            self.currCastlingRights.bQS = nRights.bQS
+                squares[move.endIndex] = EMPTY
+                squares[move.startIndex & ~7 | move.endIndex & 7] = move.takenCode
+            bits, self.enPassantSq, self.halfmoveClock, self.zobristKey, self.mgScore, self.egScore, self.phase = self.stateLog.pop()
+            self.currCastlingRights.setBits(bits)
             if move.castleMove:
-                if move.endCol - move.startCol == 2:    #King side
-                    self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 1]
-                    self.board[move.endRow][move.endCol - 1] = '--'
+                if move.endIndex - move.startIndex == 2: #King side
+                    squares[move.endIndex + 1] = squares[move.endIndex - 1]
+                    squares[move.endIndex - 1] = EMPTY
                 else:                                   #Queen side
-                    self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
-                    self.board[move.endRow][move.endCol + 1] = '--'
+                    squares[move.endIndex - 2] = squares[move.endIndex + 1]
+                    squares[move.endIndex + 1] = EMPTY
+            if self.bitboardGenerator is not None:
+                self.bitboardGenerator.applyMove(move)
 
 
     def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
+        moved = move.movedCode
+        if moved == WHITE | KING:
             self.currCastlingRights.wKS = False
             self.currCastlingRights.wQS = False
-        elif move.pieceMoved == 'bK':
+        elif moved == BLACK | KING:
             self.currCastlingRights.bKS = False
             self.currCastlingRights.bQS = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0: #Left rook
-                    self.currCastlingRights.wQS = False
-                elif move.startCol == 7: #Right rook
-                    self.currCastlingRights.wKS = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.currCastlingRights.bQS = False
-                elif move.startCol == 7:
-                    self.currCastlingRights.bKS = False
+        elif moved == WHITE | ROOK:
+            if move.startIndex == 56: #Left rook
+                self.currCastlingRights.wQS = False
+            elif move.startIndex == 63: #Right rook
+                self.currCastlingRights.wKS = False
+        elif moved == BLACK | ROOK:
+            if move.startIndex == 0:
+                self.currCastlingRights.bQS = False
+            elif move.startIndex == 7:
+                self.currCastlingRights.bKS = False
+        #A rook captured on its starting square also loses that side's castling
+        taken = move.takenCode
+        if taken == WHITE | ROOK:
+            if move.endIndex == 56:
+                self.currCastlingRights.wQS = False
+            elif move.endIndex == 63:
+                self.currCastlingRights.wKS = False
+        elif taken == BLACK | ROOK:
+            if move.endIndex == 0:
+                self.currCastlingRights.bQS = False
+            elif move.endIndex == 7:
+                self.currCastlingRights.bKS = False
 
 
 
     def getValidMoves(self):
+        cache = self.moveCache
+        if cache is not None:
+            entry = cache.get(self.zobristKey)
+            if entry is not None:
+                self.inCheck = entry[1]
+                return self.updateGameOver(list(entry[0]))
+        if self.bitboardGenerator is not None:
+            moves = self.bitboardGenerator.getValidMoves()
+        else:
+            moves = self.getMailboxMoves()
+        if cache is not None:
+            cache.put(self.zobristKey, (tuple(moves), self.inCheck))
+        return self.updateGameOver(moves)
+
+
+    #Turns on the LRU cache of legal move lists keyed by zobristKey, maxSize of 0 turns it off
+    def enableMoveCache(self, maxSize=4096):
+        self.moveCache = MoveCache(maxSize) if maxSize > 0 else None
+
+
+    def getMailboxMoves(self):
         moves = []
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-        if self.whiteTurn:
-            kingRow = self.wKingLocation[0]
-            kingCol = self.wKingLocation[1]
-        else:
-            kingRow = self.bKingLocation[0]
-            kingCol = self.bKingLocation[1]
+        kingSq = self.wKingSq if self.whiteTurn else self.bKingSq
+        self.attacked = self.getAttackMap(BLACK if self.whiteTurn else WHITE, kingSq)
         if self.inCheck:
             if len(self.checks) == 1: #Block the only check or move the king
                 moves = self.getPossibleMoves()
                 #To block the check, move a piece into the squares between the king and attacker
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol] #Attacking piece
-                validSquares = []
-                if pieceChecking[1] == "N": #If Knight, must capture knight or  move king no pins
-                    validSquares = [(checkRow, checkCol)]
+                checkSq, direction = self.checks[0]
+                if direction < 0: #If Knight, must capture knight or  move king no pins
+                    validSquares = {checkSq}
                 else:
-                    for i in range(1,8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
+                    validSquares = set()
+                    for sq in RAYS[kingSq][direction]:
+                        validSquares.add(sq)
+                        if sq == checkSq:
                             break
-                #Remove moves that don't block check or move king
-                for i in range(len(moves) -1, -1, -1): #Go backwards through iterating list when removing
-                    if moves[i].pieceMoved[1] != 'K':
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
+                #Keep only king moves and moves that capture or block the checker
+                moves = [m for m in moves if m.movedCode & TYPE_MASK == KING or m.endIndex in validSquares
+                         or (m.enPassant and m.startIndex & ~7 | m.endIndex & 7 == checkSq)]
             else: #In double check king must move
-                self.getKingMoves(kingRow, kingCol, moves)
+                self.getKingMoves(kingSq, moves)
         else:
             moves = self.getPossibleMoves()
 
+        return moves
+
+
+    def updateGameOver(self, moves):
         if len(moves) == 0:
             if self.inCheck:
                 self.checkMate = True
@@ -170,312 +568,472 @@ class GameState():
 
 
     def checkForPinsAndChecks(self):
-        pins = []
+        pins = {}
         checks = []
         inCheck = False
+        squares = self.squares
         if self.whiteTurn:
-            enemyColor = "b"
-            allyColor = "w"
-            startRow = self.wKingLocation[0]
-            startCol = self.wKingLocation[1]
+            enemyColor = BLACK
+            allyColor = WHITE
+            kingSq = self.wKingSq
+            pawnDirections = (4, 5) #Black pawns attack the king from above
         else:
-            enemyColor = "w"
-            allyColor = "b"
-            startRow = self.bKingLocation[0]
-            startCol = self.bKingLocation[1]
+            enemyColor = WHITE
+            allyColor = BLACK
+            kingSq = self.bKingSq
+            pawnDirections = (6, 7)
         #Start from king position, checking for possible attacks
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePin = ()
-            for i in range(1,8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
-                        if possiblePin == ():
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else: #Second ally piece meaning no threat is possible
-                            break
-                    elif endPiece[0] == enemyColor:
-                        enemyAttacking = endPiece[1]
-                        #Account for all possible attackers
-                        if (0 <= j <= 3 and enemyAttacking == "R") or \
-                                (4 <= j <= 7 and enemyAttacking == "B") or \
-                                (i == 1 and enemyAttacking == "p" and ((enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4<= j <= 5))) or \
-                                (enemyAttacking == "Q") or (i == 1 and enemyAttacking == "K"):
-                            if possiblePin == (): #No pins, therefore in check
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else: #Pinned piece
-                                pins.append(possiblePin)
-                                break
-                        else: #No check applied
-                            break
-                else: #Off board
+        kingRays = RAYS[kingSq]
+        for j in range(8):
+            possiblePin = -1
+            first = True
+            for sq in kingRays[j]:
+                endPiece = squares[sq]
+                if endPiece == EMPTY or endPiece == allyColor | KING:
+                    first = False
+                    continue
+                if endPiece & allyColor:
+                    if possiblePin < 0:
+                        possiblePin = sq
+                        first = False
+                    else: #Second ally piece meaning no threat is possible
+                        break
+                else:
+                    enemyAttacking = endPiece & TYPE_MASK
+                    #Account for all possible attackers
+                    if enemyAttacking == QUEEN or \
+                            (j < 4 and enemyAttacking == ROOK) or \
+                            (j >= 4 and enemyAttacking == BISHOP) or \
+                            (first and (enemyAttacking == KING or (enemyAttacking == PAWN and j in pawnDirections))):
+                        if possiblePin < 0: #No pins, therefore in check
+                            inCheck = True
+                            checks.append((sq, j))
+                        else: #Pinned piece
+                            pins[possiblePin] = j
                     break
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0<= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == "N":
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        for sq in KNIGHT_SQUARES[kingSq]:
+            if squares[sq] == enemyColor | KNIGHT:
+                inCheck = True
+                checks.append((sq, -1))
 
         return inCheck, pins, checks
 
 
-    def sqUnderAttack(self, startRow, startCol, allyColor):
-        enemyColor = 'w' if allyColor == 'b' else 'b'
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor:
-                        break
-                    elif endPiece[0] == enemyColor:
-                        enemyAttacking = endPiece[1]
-                        if (0 <= j <= 3 and enemyAttacking == "R") or \
-                                (4 <= j <= 7 and enemyAttacking == "B") or \
-                                (i == 1 and enemyAttacking == "p" and (
-                                        (enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4 <= j <= 5))) or \
-                                (enemyAttacking == "Q") or (i == 1 and enemyAttacking == "K"):
-                            return True
-                        else:
-                             break
-                else:
-                    break
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == "N":
-                    return True
+    def sqUnderAttack(self, startSq, allyColor):
+        squares = self.squares
+        enemyColor = WHITE if allyColor == BLACK else BLACK
+        pawnDirections = (6, 7) if enemyColor == WHITE else (4, 5)
+        startRays = RAYS[startSq]
+        for j in range(8):
+            first = True
+            for sq in startRays[j]:
+                endPiece = squares[sq]
+                if endPiece == EMPTY:
+                    first = False
+                    continue
+                if endPiece & enemyColor:
+                    enemyAttacking = endPiece & TYPE_MASK
+                    if enemyAttacking == QUEEN or \
+                            (j < 4 and enemyAttacking == ROOK) or \
+                            (j >= 4 and enemyAttacking == BISHOP) or \
+                            (first and (enemyAttacking == KING or (enemyAttacking == PAWN and j in pawnDirections))):
+                        return True
+                break
+        for sq in KNIGHT_SQUARES[startSq]:
+            if squares[sq] == enemyColor | KNIGHT:
+                return True
 
         return False
 
 
+    #One pass over the enemy pieces marking every square they attack, so king moves and castling
+    #are a lookup. The defending king is lifted off the board so it can't step back along a checking ray.
+    def getAttackMap(self, enemyColor, kingSq):
+        squares = self.squares
+        attacked = bytearray(64)
+        king = squares[kingSq]
+        squares[kingSq] = EMPTY
+        for sq in range(64):
+            piece = squares[sq]
+            if not piece & enemyColor:
+                continue
+            pieceType = piece & TYPE_MASK
+            if pieceType == PAWN:
+                for target in PAWN_CAPTURES[enemyColor][sq]:
+                    attacked[target] = 1
+            elif pieceType == KNIGHT:
+                for target in KNIGHT_SQUARES[sq]:
+                    attacked[target] = 1
+            elif pieceType == KING:
+                for target in KING_SQUARES[sq]:
+                    attacked[target] = 1
+            else:
+                rays = RAYS[sq]
+                for d in (range(4) if pieceType == ROOK else range(4, 8) if pieceType == BISHOP else range(8)):
+                    for target in rays[d]:
+                        attacked[target] = 1
+                        if squares[target] != EMPTY:
+                            break
+        squares[kingSq] = king
+        return attacked
+
+
     def getPossibleMoves(self):
-        moves =[]
-        for i in range(len(self.board)):
-            for j in range(len(self.board[i])):
-                turn = self.board[i][j][0]
-                if (turn == "w" and self.whiteTurn) or (turn == "b" and not self.whiteTurn):
-                    piece = self.board[i][j][1]
-                    self.moveFunctions[piece](i, j, moves)
+        moves = []
+        squares = self.squares
+        ally = WHITE if self.whiteTurn else BLACK
+        moveFunctions = self.moveFunctions
+        for sq in range(64):
+            piece = squares[sq]
+            if piece & ally:
+                moveFunctions[piece & TYPE_MASK](sq, moves)
         return moves
 
 
-    def getPawnMoves(self, i, j, moves):
-        pinned = False
-        pinDirection = ()
-        for k in range(len(self.pins)-1, -1, -1):
-            if self.pins[k][0] == i and self.pins[k][1] == j:
-                pinned = True
-                pinDirection = (self.pins[k][2], self.pins[k][3])
-                self.pins.remove(self.pins[k])
-                break
-        pawnPromotion = False
+    def getPawnMoves(self, sq, moves):
+        squares = self.squares
+        pinDirection = self.pins.get(sq, -1)
+        row, col = SQUARE_COORDS[sq]
         if self.whiteTurn:
-            if self.board[i-1][j] == "--":
-                if not pinned or pinDirection == (-1, 0):
-                    if i-1 == 0:
-                        pawnPromotion = True
-                    moves.append(Move((i, j), (i-1, j), self.board, pawnPromotion=pawnPromotion))
-                    if i == 6 and self.board[i-2][j] == "--":
-                        moves.append(Move((i, j), (i-2, j), self.board))
-            if j-1 >= 0:
-                if not pinned or pinDirection == (-1, -1):
-                    if self.board[i -1][j-1][0] == 'b':
-                        if i -1 == 0:
-                            pawnPromotion = True
-                        moves.append(Move((i, j), (i -1, j-1), self.board, pawnPromotion=pawnPromotion))
-                    if (i -1, j - 1) == self.enPassantSq:
-                        moves.append(Move((i, j), (i -1, j - 1), self.board, enPassant=True))
-            if j+1 <= 7:
-                if not pinned or pinDirection == (-1, 1):
-                    if self.board[i -1][j + 1][0] == 'b':
-                        if i -1 == 0:
-                            pawnPromotion = True
-                        moves.append(Move((i, j), (i -1, j+1), self.board, pawnPromotion=pawnPromotion))
-                    if (i -1, j + 1) == self.enPassantSq:
-                        moves.append(Move((i, j), (i -1, j + 1), self.board, enPassant=True))
-
-        if not self.whiteTurn:
-            if self.board[i+1][j] == "--":
-                if not pinned or pinDirection == (1, 0):
-                    if i+1 == 7:
-                        pawnPromotion = True
-                    moves.append(Move((i, j), (i+1, j), self.board, pawnPromotion=pawnPromotion))
-                    if i == 1 and self.board[i+2][j] == "--":
-                        moves.append(Move((i, j), (i+2, j), self.board))
-            if j-1 >= 0:
-                if not pinned or pinDirection == (1, -1):
-                    if self.board[i +1][j-1][0] == 'w':
-                        if i +1 == 7:
-                            pawnPromotion = True
-                        moves.append(Move((i, j), (i +1, j-1), self.board, pawnPromotion=pawnPromotion))
-                    if (i +1, j - 1) == self.enPassantSq:
-                        moves.append(Move((i, j), (i +1, j - 1), self.board, enPassant=True))
-            if j+1 <= 7:
-                if not pinned or pinDirection == (1, 1):
-                    if self.board[i +1][j + 1][0] == 'w':
-                        if i +1 == 7:
-                            pawnPromotion = True
-                        moves.append(Move((i, j), (i +1, j+1), self.board, pawnPromotion=pawnPromotion))
-                    if (i +1, j + 1) == self.enPassantSq:
-                        moves.append(Move((i, j), (i +1, j + 1), self.board, enPassant=True))
-
-
-    def getRookMoves(self, i, j, moves):
-        pinned = False
-        pinDirection = ()
-        for k in range(len(self.pins) - 1, -1, -1):
-            if self.pins[k][0] == i and self.pins[k][1] == j:
-                pinned = True
-                pinDirection = (self.pins[k][2], self.pins[k][3])
-                if self.board[i][j][1] != 'Q':
-                    self.pins.remove(self.pins[k])
-                break
+            enemy = BLACK
+            forward, forwardDir = -8, 0
+            startRow, lastRow = 6, 0
+            captures = ((-9, 4, col > 0), (-7, 5, col < 7))
+        else:
+            enemy = WHITE
+            forward, forwardDir = 8, 2
+            startRow, lastRow = 1, 7
+            captures = ((7, 6, col > 0), (9, 7, col < 7))
+        promotes = row + forward // 8 == lastRow
 
-        if self.whiteTurn:
-            enemy = "b"
-        if not self.whiteTurn:
-            enemy = "w"
-        directions = ((-1, 0), (1, 0), (0, -1), (0, 1)) #up, down, left, right
-        for d in directions:
-            for k in range(1,8):
-                endRow = i + (d[0] * k)
-                endCol = j + (d[1] * k)
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    if not pinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":
-                            moves.append(Move((i, j), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemy:
-                            moves.append(Move((i, j), (endRow, endCol), self.board))
-                            break
-                        else:
-                            break
+        if squares[sq + forward] == EMPTY:
+            if pinDirection < 0 or pinDirection == forwardDir or pinDirection == OPPOSITE[forwardDir]:
+                if promotes:
+                    for promotion in PROMOTION_TYPES:
+                        moves.append(getMove(sq, sq + forward, squares, PROMOTION_FLAG, promotion))
                 else:
-                    break
+                    moves.append(getMove(sq, sq + forward, squares))
+                    if row == startRow and squares[sq + 2 * forward] == EMPTY:
+                        moves.append(getMove(sq, sq + 2 * forward, squares))
+        for offset, direction, onBoard in captures:
+            if onBoard and (pinDirection < 0 or pinDirection == direction or pinDirection == OPPOSITE[direction]):
+                target = sq + offset
+                if squares[target] & enemy:
+                    if promotes:
+                        for promotion in PROMOTION_TYPES:
+                            moves.append(getMove(sq, target, squares, PROMOTION_FLAG, promotion))
+                    else:
+                        moves.append(getMove(sq, target, squares))
+                elif SQUARE_COORDS[target] == self.enPassantSq and not self.enPassantExposesKing(sq, target % 8):
+                    moves.append(getMove(sq, target, squares, EN_PASSANT_FLAG))
 
 
-    def getKnightMoves(self, i, j, moves):
-        pinned = False
-        pinDirection = ()
-        for k in range(len(self.pins) - 1, -1, -1):
-            if self.pins[k][0] == i and self.pins[k][1] == j:
-                pinned = True
-                self.pins.remove(self.pins[k])
-                break
+    #En passant removes two pawns from the same row at once, which can uncover a rook or queen on the king
+    def enPassantExposesKing(self, sq, capturedCol):
+        kingSq = self.wKingSq if self.whiteTurn else self.bKingSq
+        if kingSq // 8 != sq // 8:
+            return False
+        enemy = BLACK if self.whiteTurn else WHITE
+        capturedSq = sq - sq % 8 + capturedCol
+        for target in RAYS[kingSq][3 if capturedSq > kingSq else 1]:
+            if target != sq and target != capturedSq:
+                piece = self.squares[target]
+                if piece != EMPTY:
+                    return piece == enemy | ROOK or piece == enemy | QUEEN
+        return False
 
-        possibleMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, 2), (2, -1), (2, 1))
-        if self.whiteTurn:
-            ally = "w"
-        if not self.whiteTurn:
-            ally = "b"
-        for mov in possibleMoves:
-            endRow = i + mov[0]
-            endCol = j + mov[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                if not pinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != ally:
-                        moves.append(Move((i, j), (endRow, endCol), self.board))
-
-
-    def getBishopMoves(self, i, j, moves):
-        pinned = False
-        pinDirection = ()
-        for k in range(len(self.pins) - 1, -1, -1):
-            if self.pins[k][0] == i and self.pins[k][1] == j:
-                pinned = True
-                pinDirection = (self.pins[k][2], self.pins[k][3])
-                self.pins.remove(self.pins[k])
-                break
-        if self.whiteTurn:
-            enemy = "b"
-        if not self.whiteTurn:
-            enemy = "w"
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1)) #diag topleft, diag topright, diag botleft, diag botright
+
+    def getSlidingMoves(self, sq, directions, moves):
+        squares = self.squares
+        pinDirection = self.pins.get(sq, -1)
+        ally = WHITE if self.whiteTurn else BLACK
         for d in directions:
-            for k in range(1,8):
-                endRow = i + (d[0] * k)
-                endCol = j + (d[1] * k)
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    if not pinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":
-                            moves.append(Move((i, j), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemy:
-                            moves.append(Move((i, j), (endRow, endCol), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
+            if pinDirection < 0 or pinDirection == d or pinDirection == OPPOSITE[d]:
+                for target in RAYS[sq][d]:
+                    endPiece = squares[target]
+                    if endPiece == EMPTY:
+                        moves.append(getMove(sq, target, squares))
+                    else:
+                        if not endPiece & ally:
+                            moves.append(getMove(sq, target, squares))
+                        break
+
+
+    def getRookMoves(self, sq, moves):
+        self.getSlidingMoves(sq, (0, 2, 1, 3), moves) #up, down, left, right
+
 
+    def getKnightMoves(self, sq, moves):
+        if sq in self.pins: #A pinned knight can never stay on the pin line
+            return
+        squares = self.squares
+        ally = WHITE if self.whiteTurn else BLACK
+        for target in KNIGHT_SQUARES[sq]:
+            if not squares[target] & ally:
+                moves.append(getMove(sq, target, squares))
+
+
+    def getBishopMoves(self, sq, moves):
+        self.getSlidingMoves(sq, (4, 5, 6, 7), moves) #diag topleft, diag topright, diag botleft, diag botright
 
-    def getQueenMoves(self, i, j, moves):
-        self.getRookMoves(i, j, moves)
-        self.getBishopMoves(i, j, moves)
 
+    def getQueenMoves(self, sq, moves):
+        self.getSlidingMoves(sq, (0, 2, 1, 3, 4, 5, 6, 7), moves)
 
-    def getKingMoves(self, i, j, moves):
-        possibleMoves = ((0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1))
+
+    def getKingMoves(self, sq, moves):
+        squares = self.squares
+        attacked = self.attacked
         if self.whiteTurn:
-            ally = "w"
-        if not self.whiteTurn:
-            ally = "b"
-        for k in range(8):
-            endRow = i + possibleMoves[k][0]
-            endCol = j + possibleMoves[k][1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != ally:
-                    if ally == "w":
-                        self.wKingLocation = (endRow, endCol)
-                    else:
-                        self.bKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((i, j), (endRow, endCol), self.board))
-                    if ally == 'w':
-                        self.wKingLocation = (i, j)
-                    else:
-                        self.bKingLocation = (i, j)
-        self.getCastleMoves(i, j, moves, ally)
+            ally = WHITE
+        else:
+            ally = BLACK
+        for target in KING_SQUARES[sq]:
+            if not squares[target] & ally and not attacked[target]:
+                moves.append(getMove(sq, target, squares))
+        self.getCastleMoves(sq, moves, ally)
 
 
-    def getCastleMoves(self, i, j, moves, ally):
-        if self.sqUnderAttack(i, j, ally):
+    def getCastleMoves(self, sq, moves, ally):
+        if self.attacked[sq]:
             return
         if (self.whiteTurn and self.currCastlingRights.wKS) or (not self.whiteTurn and self.currCastlingRights.bKS):
-            self.getKSCastleMoves(i, j, moves, ally)
+            self.getKSCastleMoves(sq, moves, ally)
         if (self.whiteTurn and self.currCastlingRights.wQS) or (not self.whiteTurn and self.currCastlingRights.bQS):
-            self.getQSCastleMoves(i, j, moves, ally)
+            self.getQSCastleMoves(sq, moves, ally)
+
+
+    def getKSCastleMoves(self, sq, moves, ally):
+        squares = self.squares
+        if squares[sq+1] == EMPTY and squares[sq+2] == EMPTY and not self.attacked[sq+1] and not self.attacked[sq+2]:
+            moves.append(getMove(sq, sq+2, squares, CASTLE_FLAG))
+
+    def getQSCastleMoves(self, sq, moves, ally):
+        squares = self.squares
+        if squares[sq-1] == EMPTY and squares[sq-2] == EMPTY and squares[sq-3] == EMPTY and not self.attacked[sq-1] and not self.attacked[sq-2]:
+            moves.append(getMove(sq, sq-2, squares, CASTLE_FLAG))
+
+
+    #Staged generation for the search. getLegalityInfo() scans pins and checks once per node, captures and
+    #quiet moves are then generated separately with pins applied, and isLegal() settles check evasion and
+    #king safety only for moves that actually get tried. The info tuple is passed back in explicitly because
+    #the search makes moves in between stages, which overwrites self.pins.
+    def getLegalityInfo(self):
+        inCheck, pins, checks = self.checkForPinsAndChecks()
+        kingSq = self.wKingSq if self.whiteTurn else self.bKingSq
+        checkSquares = None
+        if len(checks) == 1:
+            checkSq, direction = checks[0]
+            if direction < 0:
+                checkSquares = {checkSq}
+            else:
+                checkSquares = set()
+                for sq in RAYS[kingSq][direction]:
+                    checkSquares.add(sq)
+                    if sq == checkSq:
+                        break
+        return inCheck, pins, checks, checkSquares, kingSq
+
+
+    def isLegal(self, move, info):
+        inCheck, pins, checks, checkSquares, kingSq = info
+        if move.movedCode & TYPE_MASK == KING:
+            if move.castleMove: #Only generated when the king's path is safe
+                return True
+            squares = self.squares
+            king = squares[kingSq]
+            squares[kingSq] = EMPTY
+            safe = not self.sqUnderAttack(move.endIndex, king & COLOR_MASK)
+            squares[kingSq] = king
+            return safe
+        if move.enPassant: #Rare enough to just play it out
+            ally = move.movedCode & COLOR_MASK
+            self.makeMove(move)
+            safe = not self.sqUnderAttack(kingSq, ally)
+            self.unndoMove()
+            return safe
+        if inCheck:
+            return len(checks) == 1 and move.endIndex in checkSquares
+        return True
+
 
+    #Pseudo-legal move from start to end for the piece standing on start, or None
+    def findMove(self, start, end, info, promotion=0):
+        squares = self.squares
+        ally = WHITE if self.whiteTurn else BLACK
+        piece = squares[start]
+        if not piece & ally or squares[end] & ally:
+            return None
+        if piece & TYPE_MASK == KING:
+            if end in KING_SQUARES[start]:
+                return getMove(start, end, squares)
+            return None
+        moves = []
+        self.pins = info[1]
+        self.moveFunctions[piece & TYPE_MASK](start, moves)
+        for move in moves:
+            if move.endIndex == end and move.promotionType == promotion:
+                return move
+        return None
+
+
+    #Captures, en passant and promotions
+    def getCaptureMoves(self, moves, info):
+        squares = self.squares
+        pins = self.pins = info[1]
+        ally, enemy = (WHITE, BLACK) if self.whiteTurn else (BLACK, WHITE)
+        for sq in range(64):
+            piece = squares[sq]
+            if not piece & ally:
+                continue
+            pieceType = piece & TYPE_MASK
+            if pieceType == PAWN:
+                pawnMoves = []
+                self.getPawnMoves(sq, pawnMoves)
+                moves.extend(move for move in pawnMoves if move.takenCode != EMPTY or move.pawnPromotion)
+            elif pieceType == KNIGHT:
+                if sq not in pins:
+                    for target in KNIGHT_SQUARES[sq]:
+                        if squares[target] & enemy:
+                            moves.append(getMove(sq, target, squares))
+            elif pieceType == KING:
+                for target in KING_SQUARES[sq]:
+                    if squares[target] & enemy:
+                        moves.append(getMove(sq, target, squares))
+            else:
+                pinDirection = pins.get(sq, -1)
+                for d in SLIDER_DIRECTIONS[pieceType]:
+                    if pinDirection < 0 or pinDirection == d or pinDirection == OPPOSITE[d]:
+                        for target in RAYS[sq][d]:
+                            endPiece = squares[target]
+                            if endPiece != EMPTY:
+                                if endPiece & enemy:
+                                    moves.append(getMove(sq, target, squares))
+                                break
+
+
+    #Everything getCaptureMoves leaves out, castling included
+    def getQuietMoves(self, moves, info):
+        squares = self.squares
+        pins = self.pins = info[1]
+        ally = WHITE if self.whiteTurn else BLACK
+        for sq in range(64):
+            piece = squares[sq]
+            if not piece & ally:
+                continue
+            pieceType = piece & TYPE_MASK
+            if pieceType == PAWN:
+                pawnMoves = []
+                self.getPawnMoves(sq, pawnMoves)
+                moves.extend(move for move in pawnMoves if move.takenCode == EMPTY and not move.pawnPromotion)
+            elif pieceType == KNIGHT:
+                if sq not in pins:
+                    for target in KNIGHT_SQUARES[sq]:
+                        if squares[target] == EMPTY:
+                            moves.append(getMove(sq, target, squares))
+            elif pieceType == KING:
+                for target in KING_SQUARES[sq]:
+                    if squares[target] == EMPTY:
+                        moves.append(getMove(sq, target, squares))
+                if not info[0]:
+                    self.getSafeCastleMoves(sq, moves, ally)
+            else:
+                pinDirection = pins.get(sq, -1)
+                for d in SLIDER_DIRECTIONS[pieceType]:
+                    if pinDirection < 0 or pinDirection == d or pinDirection == OPPOSITE[d]:
+                        for target in RAYS[sq][d]:
+                            if squares[target] != EMPTY:
+                                break
+                            moves.append(getMove(sq, target, squares))
+
+
+    #Castling checked square by square, for when there is no attack map
+    def getSafeCastleMoves(self, sq, moves, ally):
+        squares = self.squares
+        if self.whiteTurn:
+            kingSide, queenSide = self.currCastlingRights.wKS, self.currCastlingRights.wQS
+        else:
+            kingSide, queenSide = self.currCastlingRights.bKS, self.currCastlingRights.bQS
+        if kingSide and squares[sq+1] == EMPTY and squares[sq+2] == EMPTY \
+                and not self.sqUnderAttack(sq+1, ally) and not self.sqUnderAttack(sq+2, ally):
+            moves.append(getMove(sq, sq+2, squares, CASTLE_FLAG))
+        if queenSide and squares[sq-1] == EMPTY and squares[sq-2] == EMPTY and squares[sq-3] == EMPTY \
+                and not self.sqUnderAttack(sq-1, ally) and not self.sqUnderAttack(sq-2, ally):
+            moves.append(getMove(sq, sq-2, squares, CASTLE_FLAG))
+
+
+
+#Read/write view of the flat square array as the old 8x8 grid of "wK"/"--" strings
+class BoardView():
+    def __init__(self, squares):
+        self.squares = squares
+
+    def __getitem__(self, row):
+        return BoardRow(self.squares, row * 8)
+
+    def __len__(self):
+        return 8
+
+    def __iter__(self):
+        for row in range(8):
+            yield BoardRow(self.squares, row * 8)
+
+    def toList(self):
+        return [[PIECE_NAMES[self.squares[row * 8 + col]] for col in range(8)] for row in range(8)]
+
+
+class BoardRow():
+    def __init__(self, squares, offset):
+        self.squares = squares
+        self.offset = offset
+
+    def __getitem__(self, col):
+        return PIECE_NAMES[self.squares[self.offset + col]]
+
+    def __setitem__(self, col, piece):
+        self.squares[self.offset + col] = PIECE_CODES[piece]
 
-    def getKSCastleMoves(self, i, j, moves, ally):
-        if self.board[i][j+1] == '--' and self.board[i][j+2] == '--' and not self.sqUnderAttack(i, j+1, ally) and not self.sqUnderAttack(i, j+2, ally):
-            moves.append(Move((i, j), (i, j+2), self.board, castleMove=True))
+    def __len__(self):
+        return 8
 
-    def getQSCastleMoves(self, i, j, moves, ally):
-        if self.board[i][j-1] == '--' and self.board[i][j-2] == '--' and self.board[i][j-3] == '--' and not self.sqUnderAttack(i, j-1, ally) and not self.sqUnderAttack(i, j-2, ally):
-            moves.append(Move((i, j), (i, j-2), self.board, castleMove=True))
+    def __iter__(self):
+        for col in range(8):
+            yield PIECE_NAMES[self.squares[self.offset + col]]
 
 
+#Bounded least recently used map of position key -> (legal moves, in check)
+class MoveCache():
+    def __init__(self, maxSize=4096):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxSize": self.maxSize,
+                "hitRate": self.hits / lookups if lookups else 0.0}
+
 
 class castleRights():
     def __init__(self, wKS, bKS, wQS, bQS):
@@ -484,25 +1042,90 @@ class castleRights():
         self.wQS = wQS
         self.bQS = bQS
 
+    def toBits(self):
+        return self.wKS | self.wQS << 1 | self.bKS << 2 | self.bQS << 3
+
+    def setBits(self, bits):
+        self.wKS = bits & 1 != 0
+        self.wQS = bits & 2 != 0
+        self.bKS = bits & 4 != 0
+        self.bQS = bits & 8 != 0
+
+    @classmethod
+    def fromBits(cls, bits):
+        rights = cls(False, False, False, False)
+        rights.setBits(bits)
+        return rights
+
+#A move with everything it needs for makeMove and undo. Instances are pooled by getMove() and shared,
+#row/col and the piece names are only worked out when the UI or notation asks for them.
 class Move():
+    __slots__ = ("packed", "startIndex", "endIndex", "movedCode", "takenCode", "enPassant", "pawnPromotion",
+                 "promotionType", "castleMove", "moveID")
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, castleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceTaken = board[self.endRow][self.endCol]
-        self.enPassant = enPassant
-        self.pawnPromotion = pawnPromotion
-        self.castleMove = castleMove
+    #promotion is the piece letter a pawn promotes to, "Q", "R", "B" or "N"
+    def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, castleMove=False, promotion="Q"):
+        start = startSq[0] * 8 + startSq[1]
+        end = endSq[0] * 8 + endSq[1]
+        moved = board.squares[start]
+        taken = board.squares[end]
         if enPassant:
-            self.pieceTaken = 'bp' if self.pieceMoved == 'wp' else 'wp'
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow *10 + self.endCol
+            taken = PAWN | (BLACK if moved & WHITE else WHITE)
+        flags = enPassant * EN_PASSANT_FLAG | pawnPromotion * PROMOTION_FLAG | castleMove * CASTLE_FLAG
+        self.unpack(packMove(start, end, moved, taken, flags, PIECE_TYPES[promotion] if pawnPromotion else 0))
+
+
+    @classmethod
+    def fromPacked(cls, packed):
+        move = cls.__new__(cls)
+        move.unpack(packed)
+        return move
+
+
+    def unpack(self, packed):
+        self.packed = packed
+        self.startIndex = packed & 63
+        self.endIndex = packed >> 6 & 63
+        self.enPassant = bool(packed >> 12 & EN_PASSANT_FLAG)
+        self.pawnPromotion = bool(packed >> 12 & PROMOTION_FLAG)
+        self.castleMove = bool(packed >> 12 & CASTLE_FLAG)
+        self.movedCode = packed >> 15 & 31
+        self.takenCode = packed >> 20 & 31
+        self.promotionType = packed >> 25 #0 unless the move promotes
+        self.moveID = packed & 0xFFF | self.promotionType << 12 #Start and end square and promotion piece, what two moves are compared by
+
+
+    @property
+    def startRow(self):
+        return self.startIndex >> 3
+
+    @property
+    def startCol(self):
+        return self.startIndex & 7
+
+    @property
+    def endRow(self):
+        return self.endIndex >> 3
+
+    @property
+    def endCol(self):
+        return self.endIndex & 7
+
+    @property
+    def pieceMoved(self):
+        return PIECE_NAMES[self.movedCode]
+
+    @property
+    def pieceTaken(self):
+        return PIECE_NAMES[self.takenCode]
+
+    @property
+    def pieceCreated(self):
+        return PIECE_NAMES[self.movedCode & COLOR_MASK | self.promotionType] if self.pawnPromotion else self.pieceMoved
 
 
     def __eq__(self, other):
@@ -511,9 +1134,22 @@ class Move():
         return False
 
 
+    def __hash__(self):
+        return self.moveID
+
+
+    #Coordinate notation, with the promotion piece in lower case like UCI: e2e4, e7e8q
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.pawnPromotion:
+            notation += PIECE_NAMES[self.promotionType | WHITE][1].lower()
+        return notation
 
 
     def getRankFile(self, row, col):
-        return self.colsToFiles[col] + self.rowsToRanks[row]
\ No newline at end of file
+        return self.colsToFiles[col] + self.rowsToRanks[row]
+
+
+#Timing of the hot functions, switched on from the environment so games started by any tool can be measured
+if os.environ.get("CHESS_INSTRUMENT", "") not in ("", "0"):
+    from Chess import Instrument
@@ -0,0 +1,105 @@
+import atexit
+import os
+import sys
+from time import perf_counter_ns
+from Chess import Engine
+
+
+#Opt-in call counts and timings for the move generator's hot functions. Nothing is touched until enable() is
+#called (or CHESS_INSTRUMENT=1 is set before Engine is imported), it then swaps the methods on the classes for
+#wrappers, so a disabled run pays nothing at all. Times are inclusive, getValidMoves contains the time of the
+#generator functions it calls. Counters aren't locked, numbers from several threads at once are approximate.
+
+ENV_VARIABLE = "CHESS_INSTRUMENT"
+GAME_STATE_METHODS = ("getValidMoves", "checkForPinsAndChecks", "sqUnderAttack", "makeMove", "unndoMove",
+                      "getPawnMoves", "getRookMoves", "getKnightMoves", "getBishopMoves", "getQueenMoves",
+                      "getKingMoves")
+
+STATS = {} #Name -> [calls, nanoseconds]
+MOVE_COUNTS = {"allocated": 0} #Move objects built, pooled or not
+_originals = [] #(owner, attribute, original) for disable()
+_dumpRegistered = False
+
+
+def _timed(stat, func):
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stat[0] += 1
+            stat[1] += perf_counter_ns() - start
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def _counted(func):
+    def wrapper(*args):
+        MOVE_COUNTS["allocated"] += 1
+        return func(*args)
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def _patch(owner, attribute, wrapper):
+    _originals.append((owner, attribute, getattr(owner, attribute)))
+    setattr(owner, attribute, wrapper)
+
+
+def isEnabled():
+    return bool(_originals)
+
+
+#GameStates built before this keep the unwrapped generator functions in their moveFunctions dict
+def enable(dumpAtExit=True):
+    global _dumpRegistered
+    if isEnabled():
+        return
+    for name in GAME_STATE_METHODS:
+        _patch(Engine.GameState, name, _timed(STATS.setdefault(name, [0, 0]), getattr(Engine.GameState, name)))
+    getMove = _timed(STATS.setdefault("getMove", [0, 0]), Engine.getMove)
+    _patch(Engine, "getMove", getMove)
+    bitboard = sys.modules.get("Chess.Bitboard")
+    if hasattr(bitboard, "getMove"): #Imported by name there, if it's imported later it picks up the wrapper
+        _patch(bitboard, "getMove", getMove)
+    _patch(Engine.Move, "unpack", _counted(Engine.Move.unpack)) #Every new Move goes through unpack once
+    if dumpAtExit and not _dumpRegistered:
+        atexit.register(dump)
+        _dumpRegistered = True
+
+
+def disable():
+    while _originals:
+        owner, attribute, original = _originals.pop()
+        setattr(owner, attribute, original)
+    bitboard = sys.modules.get("Chess.Bitboard")
+    if hasattr(getattr(bitboard, "getMove", None), "__wrapped__"): #Imported after enable()
+        bitboard.getMove = Engine.getMove
+
+
+def reset():
+    for stat in STATS.values():
+        stat[0] = stat[1] = 0
+    MOVE_COUNTS["allocated"] = 0
+
+
+#Copy of the numbers so far: {"functions": {name: {"calls", "seconds"}}, "moves": {"allocated", "pooled"}}
+def snapshot():
+    functions = {name: {"calls": calls, "seconds": nanoseconds / 1e9} for name, (calls, nanoseconds) in STATS.items()}
+    return {"functions": functions, "moves": {"allocated": MOVE_COUNTS["allocated"], "pooled": len(Engine.MOVE_POOL)}}
+
+
+def dump(out=None):
+    out = out or sys.stderr
+    stats = snapshot()
+    out.write("%-22s %12s %12s %10s\n" % ("function", "calls", "seconds", "us/call"))
+    for name, stat in sorted(stats["functions"].items(), key=lambda item: -item[1]["seconds"]):
+        if stat["calls"]:
+            out.write("%-22s %12d %12.3f %10.2f\n"
+                      % (name, stat["calls"], stat["seconds"], stat["seconds"] * 1e6 / stat["calls"]))
+    out.write("Move objects allocated %d, %d in the pool\n" % (stats["moves"]["allocated"], stats["moves"]["pooled"]))
+    out.flush()
+
+
+if os.environ.get(ENV_VARIABLE, "") not in ("", "0"):
+    enable()
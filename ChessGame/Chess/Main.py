@@ -1,46 +1,311 @@
-import pygame as p
-from Chess import Engine
+import os
+import struct
+import threading
+import traceback
+from Chess import Book, Engine, Search, Tablebase
+
+p = None #pygame, only imported by loadPygame() once there's a window to show so engine-only use stays light
 
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15
+MAX_FPS = 60
 IMAGES = {}
+PLAYER_ONE = True  #True if a human plays white, False for the computer
+PLAYER_TWO = False #Same for black
+AI_TIME = 1.0      #Seconds the computer may think per move
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+BOOK_FILE = os.path.join(PACKAGE_DIR, "book.bin") #Polyglot book in the package the computer plays from while in book, if there
+TABLEBASE_DIR = os.path.join(PACKAGE_DIR, "tablebases") #KQK/KRK tables from python -m Chess.Tablebase Chess/tablebases --build, used if present
+SQUARE_MS = 116    #Milliseconds a moving piece takes per square, 7 frames at 60 FPS
+NO_HIGHLIGHT, SELECTED, TARGET, PICKER = 0, 1, 2, 3
+IMAGE_DIR = os.path.join(PACKAGE_DIR, "images")
+PIECES = ["wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK"]
+ATLAS_MAGIC = b"CGSA"
+ATLAS_HEADER = struct.Struct(">4sIIQ") #Magic, square size, piece count, mtime of the newest piece image in ns
+
+
+def loadPygame():
+    global p
+    if p is None:
+        import pygame
+        p = pygame
+    return p
+
 
-#Makes a dictionary containing all the piece images.
+#Every piece scaled to SQ_SIZE side by side as raw RGBA, cached next to the images per square size
+#and rebuilt from the PNGs when one of them changes
+def loadAtlasPixels():
+    sources = [os.path.join(IMAGE_DIR, piece + ".png") for piece in PIECES]
+    newest = max(os.stat(source).st_mtime_ns for source in sources)
+    path = os.path.join(IMAGE_DIR, "pieces-%d.atlas" % SQ_SIZE)
+    size = SQ_SIZE * SQ_SIZE * 4 * len(PIECES)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if ATLAS_HEADER.unpack_from(data) == (ATLAS_MAGIC, SQ_SIZE, len(PIECES), newest) \
+                and len(data) == ATLAS_HEADER.size + size:
+            return data[ATLAS_HEADER.size:]
+    except (OSError, struct.error): #Not built yet or cut short
+        pass
+    atlas = p.Surface((SQ_SIZE * len(PIECES), SQ_SIZE), p.SRCALPHA)
+    for i, source in enumerate(sources):
+        atlas.blit(p.transform.scale(p.image.load(source), (SQ_SIZE, SQ_SIZE)), (i * SQ_SIZE, 0))
+    pixels = p.image.tostring(atlas, "RGBA")
+    try:
+        with open(path + ".tmp", "wb") as f:
+            f.write(ATLAS_HEADER.pack(ATLAS_MAGIC, SQ_SIZE, len(PIECES), newest))
+            f.write(pixels)
+        os.replace(path + ".tmp", path)
+    except OSError: #Read-only install, build it again next launch
+        pass
+    return pixels
+
+
+#Makes a dictionary containing all the piece images, each one a piece of one converted atlas surface.
+#Needs the display set up first for convert_alpha.
 def LoadImages():
-    pieces = ["wp", "wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR", "bp", "bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"]
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+    loadPygame()
+    width = SQ_SIZE * len(PIECES)
+    atlas = p.image.frombuffer(loadAtlasPixels(), (width, SQ_SIZE), "RGBA").convert_alpha()
+    for i, piece in enumerate(PIECES):
+        IMAGES[piece] = atlas.subsurface(p.Rect(i * SQ_SIZE, 0, SQ_SIZE, SQ_SIZE))
+
+
+#Generates the legal moves and does the computer's thinking in a background thread, on its own copy of the
+#position so the board being drawn never changes under the renderer
+class EngineWorker():
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.gs = Engine.GameState()
+        self.gs.enableMoveCache() #Undo and replayed positions reuse their move lists
+        self.thread = None
+        self.result = None
+
+
+    #think asks for the computer's move on top of the legal moves
+    def start(self, gs, think):
+        self.cancel()
+        self.searcher.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.work, args=(gs.getFen(), think), daemon=True)
+        self.thread.start()
+
+
+    #A failure is handed back as the result, the game loop would otherwise wait on a dead thread forever
+    def work(self, fen, think):
+        try:
+            self.gs.loadFen(fen)
+            moves = self.gs.getValidMoves()
+            flags = (self.gs.inCheck, self.gs.checkMate, self.gs.staleMate)
+            bestMove = None
+            if think and moves:
+                bestMove = Search.findBestMove(self.gs, AI_TIME, searcher=self.searcher)
+            self.result = (moves, flags, bestMove)
+        except Exception as e:
+            self.result = e
+
+
+    def busy(self):
+        return self.thread is not None
+
+
+    #(legal moves, (inCheck, checkMate, staleMate), computer move or None) once the work is done, the exception
+    #if it failed, else None
+    def poll(self):
+        if self.thread is None or self.thread.is_alive():
+            return None
+        self.thread = None
+        return self.result
+
+
+    #Stops the search and throws away whatever it was working on
+    def cancel(self):
+        if self.thread is not None:
+            self.searcher.stopEvent.set()
+            self.thread.join()
+            self.thread = None
+        self.result = None
+
+
+#Slides the piece of a move already made from its start square to its end square. Driven by the clock rather
+#than the frame count, the main loop asks for the position each frame and drops it once done.
+class MoveAnimation():
+    def __init__(self, move):
+        self.move = move
+        self.startTime = p.time.get_ticks()
+        self.duration = (abs(move.endRow - move.startRow) + abs(move.endCol - move.startCol)) * SQUARE_MS
+
+
+    def progress(self):
+        return min((p.time.get_ticks() - self.startTime) / self.duration, 1)
+
+
+    def done(self):
+        return self.progress() >= 1
+
+
+    #Top left pixel of the moving piece this frame
+    def position(self):
+        move = self.move
+        t = self.progress()
+        return ((move.startCol + (move.endCol - move.startCol) * t) * SQ_SIZE,
+                (move.startRow + (move.endRow - move.startRow) * t) * SQ_SIZE)
+
+
+#Squares the promotion picker uses, running from the promotion square towards the middle of the board
+def pickerSquares(move):
+    step = 1 if move.endRow == 0 else -1
+    return [(move.endRow + step * i, move.endCol) for i in range(len(Engine.PROMOTION_TYPES))]
+
+
+#Keeps the empty board, highlight squares and fonts around and only redraws squares that changed since the
+#last frame, returning their rects for p.display.update
+class BoardRenderer():
+    def __init__(self, screen):
+        loadPygame()
+        self.screen = screen
+        self.colors = [p.Color("white"), p.Color("gray")]
+        self.boardSurface = p.Surface((WIDTH, HEIGHT))
+        for i in range(DIMENSION):
+            for j in range(DIMENSION):
+                p.draw.rect(self.boardSurface, self.colors[(i+j) % 2], p.Rect(j*SQ_SIZE, i*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        self.highlights = {}
+        for kind, color in ((SELECTED, 'blue'), (TARGET, 'yellow'), (PICKER, 'green')):
+            s = p.Surface((SQ_SIZE, SQ_SIZE))
+            s.set_alpha(100)
+            s.fill(p.Color(color))
+            self.highlights[kind] = s
+        self.font = p.font.SysFont("Helvetica", 32, True, False)
+        self.textCache = {}
+        self.drawn = [None] * 64 #(piece, highlight) each square shows right now
+        self.message = None
+        self.spriteSquares = [] #Squares the moving piece was drawn over last frame
+
+
+    #Forces a full redraw next frame, after something else drew over the screen
+    def invalidate(self):
+        self.drawn = [None] * 64
+
+
+    #animation is the MoveAnimation running, promotionChoices the moves the promotion picker offers
+    def draw(self, gs, validMoves, sqSelected, message=None, animation=None, promotionChoices=()):
+        states = [(piece, NO_HIGHLIGHT) for row in gs.board for piece in row]
+        if sqSelected != ():
+            i, j = sqSelected
+            if gs.board[i][j][0] == ('w' if gs.whiteTurn else 'b'): #Makes sure piece selected is valid piece
+                states[i*8 + j] = (states[i*8 + j][0], SELECTED)
+                for move in validMoves:
+                    if move.startRow == i and move.startCol == j:
+                        states[move.endIndex] = (states[move.endIndex][0], TARGET)
+        for move, (i, j) in zip(promotionChoices, pickerSquares(promotionChoices[0]) if promotionChoices else ()):
+            states[i*8 + j] = (move.pieceCreated, PICKER)
+        if animation is not None:
+            #The piece is still on its way, the end square shows what was there before
+            move = animation.move
+            states[move.endIndex] = ("--", NO_HIGHLIGHT)
+            takenSq = move.startIndex & ~7 | move.endIndex & 7 if move.enPassant else move.endIndex
+            states[takenSq] = (move.pieceTaken, NO_HIGHLIGHT)
+        if message != self.message:
+            self.message = message
+            self.invalidate()
+        for sq in self.spriteSquares:
+            self.drawn[sq] = None
+        dirty = []
+        for sq in range(64):
+            if states[sq] != self.drawn[sq]:
+                dirty.append(self.drawSquare(sq, states[sq]))
+                self.drawn[sq] = states[sq]
+        if dirty and message is not None:
+            dirty.append(self.drawText(message))
+        self.spriteSquares = []
+        if animation is not None:
+            dirty.append(self.drawSprite(animation.move.pieceMoved, animation.position()))
+        return dirty
+
+
+    def drawSprite(self, piece, position):
+        x, y = position
+        rect = p.Rect(int(x), int(y), SQ_SIZE, SQ_SIZE)
+        self.screen.blit(IMAGES[piece], rect)
+        for row in range(rect.top // SQ_SIZE, (rect.bottom - 1) // SQ_SIZE + 1):
+            for col in range(rect.left // SQ_SIZE, (rect.right - 1) // SQ_SIZE + 1):
+                self.spriteSquares.append(row*8 + col)
+        return rect
+
+
+    def drawSquare(self, sq, state):
+        piece, highlight = state
+        rect = p.Rect(sq % 8 * SQ_SIZE, sq // 8 * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.boardSurface, rect, rect)
+        if highlight != NO_HIGHLIGHT:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+
+    #Text for Checkmate/Stalemate, rendered once per message
+    def drawText(self, text):
+        if text not in self.textCache:
+            self.textCache[text] = (self.font.render(text, 0, p.Color('Grey')), self.font.render(text, 0, p.Color('Black')))
+        shadow, textObj = self.textCache[text]
+        textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObj.get_width()/2, HEIGHT/2 - textObj.get_height()/2)
+        self.screen.blit(shadow, textLocation)
+        self.screen.blit(textObj, textLocation.move(2,2))
+        return p.Rect(textLocation.topleft, (textObj.get_width() + 2, textObj.get_height() + 2))
 
 
 #Main function that will handle user input, updating board, etc.
 def main():
+    loadPygame()
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     gs = Engine.GameState()
-    validMoves = gs.getValidMoves()
+    validMoves = [] #Filled in by the worker, no moves can be made until it's done
     moveMade = False
     animate = False
+    animation = None #MoveAnimation of the last move while it plays
+    promotionChoices = [] #One move per piece while the player picks what a pawn promotes to
     LoadImages() #Images only loaded once
+    renderer = BoardRenderer(screen)
     running = True
     sqSelected = ()
     currentMove = [] #Keep track of starting and ending square coordinates
     gameOver = False
+    book = Book.OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
+    tablebase = Tablebase.Tablebases(TABLEBASE_DIR) if os.path.isdir(TABLEBASE_DIR) else None
+    searcher = Search.Searcher(book=book, tablebase=tablebase) #Kept across moves so its transposition table carries over
+    worker = EngineWorker(searcher)
+    playerOne, playerTwo = PLAYER_ONE, PLAYER_TWO #A side goes over to the human if the computer fails on it
+    engineFailed = False #Shows a message until the next move
+    worker.start(gs, not playerOne)
 
     while running:
+        humanTurn = (gs.whiteTurn and playerOne) or (not gs.whiteTurn and playerTwo)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
             #Moving pieces
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not gameOver:
+                if not gameOver and humanTurn and not worker.busy() and animation is None:
                     location = p.mouse.get_pos()
                     col = location[0]//SQ_SIZE
                     row = location[1]//SQ_SIZE
+                    if promotionChoices:
+                        #A click on the picker makes the promotion, anywhere else backs out of the move
+                        for move, square in zip(promotionChoices, pickerSquares(promotionChoices[0])):
+                            if square == (row, col):
+                                print(move.getChessNotation())
+                                gs.makeMove(move)
+                                moveMade = True
+                                animate = True
+                        promotionChoices = []
+                        sqSelected = ()
+                        currentMove = []
+                        continue
                     if sqSelected == (row, col): #Player clicked same square twice, reset move.
                         sqSelected = ()
                         currentMove = []
@@ -50,127 +315,99 @@ def main():
                     #Checks to see if move is valid
                     if len(currentMove) == 2:
                         move = Engine.Move(currentMove[0], currentMove[1], gs.board)
-                        print(move.getChessNotation())
-                        for i in range(len(validMoves)):
-                            if move == validMoves[i]:
-                                gs.makeMove(validMoves[i])
-                                moveMade = True
-                                animate = True
-                                sqSelected = ()
-                                currentMove = []
-                        if not moveMade:
+                        matches = [valid for valid in validMoves
+                                   if valid.startIndex == move.startIndex and valid.endIndex == move.endIndex]
+                        if len(matches) > 1: #A promotion, one move per piece, so ask which
+                            promotionChoices = matches
+                        elif matches:
+                            print(move.getChessNotation())
+                            gs.makeMove(matches[0])
+                            moveMade = True
+                            animate = True
+                            sqSelected = ()
+                            currentMove = []
+                        else:
                             currentMove = [sqSelected]
 
             elif e.type == p.KEYDOWN:
                 #Undo move using "z"
                 if e.key == p.K_z:
+                    worker.cancel()
                     gs.unndoMove()
+                    #Against the computer its reply comes off too, back to the human's last move
+                    while (playerOne or playerTwo) and gs.moveLog and not (playerOne if gs.whiteTurn else playerTwo):
+                        gs.unndoMove()
+                    animation = None
+                    promotionChoices = []
                     moveMade = True
                     #Don't animate when undoing
                     animate = False
+                    gameOver = False
                 #Reset board using "r"
                 if e.key == p.K_r:
+                    worker.cancel()
                     gs = Engine.GameState()
-                    validMoves = gs.getValidMoves()
+                    animation = None
+                    promotionChoices = []
                     sqSelected = ()
                     playerClicks = []
-                    moveMade = False
+                    moveMade = True
                     animate = False
+                    gameOver = False
+
+        if animation is not None and animation.done():
+            animation = None
+
+        #Legal moves and the computer's move come back from the worker, held back until the last move has played out
+        result = worker.poll() if animation is None else None
+        if isinstance(result, Exception):
+            traceback.print_exception(type(result), result, result.__traceback__)
+            if not humanTurn:
+                #The computer gives up the side it failed on and the human plays it from here, the worker
+                #only has to find the legal moves now
+                if gs.whiteTurn:
+                    playerOne = True
+                else:
+                    playerTwo = True
+                humanTurn = True
+                engineFailed = True
+                worker.start(gs, False)
+                result = None
+            else:
+                moves = gs.getValidMoves()
+                result = (moves, (gs.inCheck, gs.checkMate, gs.staleMate), None)
+        if result is not None:
+            validMoves, (gs.inCheck, gs.checkMate, gs.staleMate), AIMove = result
+            if AIMove is not None and not humanTurn:
+                gs.makeMove(AIMove)
+                moveMade = True
+                animate = True
 
         if moveMade:
             if animate:
-                moveAnimation(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
+                animation = MoveAnimation(gs.moveLog[-1])
+            validMoves = []
+            gs.checkMate = gs.staleMate = False #Worked out again by the worker
+            humanTurn = (gs.whiteTurn and playerOne) or (not gs.whiteTurn and playerTwo)
+            worker.start(gs, not humanTurn)
             moveMade = False
             animate = False
+            engineFailed = False
 
-        drawGameState(screen, gs, validMoves, sqSelected)
-
+        message = None
         if gs.checkMate:
             gameOver = True
-            if gs.whiteTurn:
-                drawText(screen, 'Black Wins By Checkmate')
-            else:
-                drawText(screen, 'White Wns By Checkmate')
+            message = 'Black Wins By Checkmate' if gs.whiteTurn else 'White Wins By Checkmate'
         elif gs.staleMate:
             gameOver = True
-            drawText(screen, 'Stalemate')
+            message = 'Stalemate'
+        elif engineFailed:
+            message = 'Engine Error, Your Move'
 
+        dirty = renderer.draw(gs, validMoves, sqSelected, message, animation, promotionChoices)
+        if dirty:
+            p.display.update(dirty)
         clock.tick(MAX_FPS)
-        p.display.flip()
-
-
-#Highlights the possible moves for the current selected piece
-def highlight(screen, gs, validMoves, sqSelected):
-    if sqSelected != ():
-        i, j = sqSelected
-        if gs.board[i][j][0] == ('w' if gs.whiteTurn else 'b'): #Makes sure piece selected is valid piece
-            #Highlight selected piece
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(p.Color('blue'))
-            screen.blit(s, (j*SQ_SIZE, i*SQ_SIZE))
-            #Highlight the possible moves for that piece
-            s.fill(p.Color('yellow'))
-            for move in validMoves:
-                if move.startRow == i and move.startCol == j:
-                    screen.blit(s, (move.endCol*SQ_SIZE, move.endRow*SQ_SIZE))
-
-
-def drawBoard(screen):
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for i in range(DIMENSION):
-        for j in range(DIMENSION):
-            color = colors[((i+j)%2)]
-            p.draw.rect(screen, color, p.Rect(j*SQ_SIZE, i*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def drawPieces(screen, board):
-    for i in range(DIMENSION):
-        for j in range(DIMENSION):
-            piece = board[i][j]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(j*SQ_SIZE, i*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def drawGameState(screen, gs, validMoves, sqSelected):
-    drawBoard(screen)
-    highlight(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)
-
-
-def moveAnimation(move, screen, board, clock):
-    global colors
-    deltaR = move.endRow - move.startRow
-    deltaC = move.endCol - move.startCol
-    framesPS = 7                                              #Speed of the animation
-    frameCount = (abs(deltaR) + abs(deltaC)) * framesPS       #Makes the speed consistent based on move distance
-    for frame in range(frameCount + 1):
-        i, j = (move.startRow + deltaR*frame/frameCount, move.startCol + deltaC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        #Remove piece from ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSq = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSq)
-        #Put back piece taken
-        if move.pieceTaken != '--':
-            screen.blit(IMAGES[move.pieceTaken], endSq)
-        #Draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(j*SQ_SIZE, i*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
-
-
-#Text function for Checkmate/Stalemate
-def drawText(screen, text):
-    font = p.font.SysFont("Helvetica", 32, True, False)
-    textObj = font.render(text, 0, p.Color('Grey'))
-    textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObj.get_width()/2, HEIGHT/2 - textObj.get_height()/2)
-    screen.blit(textObj, textLocation)
-    textObj = font.render(text, 0, p.Color('Black'))
-    screen.blit(textObj, textLocation.move(2,2))
 
 
 if __name__ == "__main__":
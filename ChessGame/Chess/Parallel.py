@@ -0,0 +1,84 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from Chess import Engine, Perft, Search
+from Chess.Transposition import encodeMove
+
+
+_stopEvent = None #Shared stop event of the pool this worker belongs to
+
+
+def _initWorker(stopEvent):
+    global _stopEvent
+    _stopEvent = stopEvent
+
+
+#Workers rebuild the position from GameState.packPosition() bytes, the GameState itself never gets pickled
+def _loadPosition(packed, generator="mailbox"):
+    gs = Engine.GameState()
+    gs.setGenerator(generator)
+    gs.loadPackedPosition(packed)
+    return gs
+
+
+def _perftWorker(packed, depth, generator):
+    return Perft.perft(_loadPosition(packed, generator), depth)
+
+
+#Iterative deepening over one chunk of root moves, returns (depth, score, packed best move) per finished depth
+def _searchWorker(packed, rootMoves, maxDepth, timeLimit, hashMB):
+    gs = _loadPosition(packed)
+    iterations = []
+
+    def info(result):
+        iterations.append((result.depth, result.score, encodeMove(result.bestMove), result.nodes))
+
+    searcher = Search.Searcher(hashMB)
+    searcher.stopEvent = _stopEvent
+    searcher.search(gs, maxDepth, timeLimit, info, rootFilter=set(rootMoves))
+    return iterations
+
+
+def defaultWorkers():
+    return os.cpu_count() or 1
+
+
+#Perft with each root move's subtree counted in its own process. Returns (total, [(notation, nodes)])
+def parallelPerft(gs, depth, workers=None, generator="mailbox"):
+    if depth <= 1:
+        moves = gs.getValidMoves()
+        return len(moves) if depth == 1 else 1, [(move.getChessNotation(), 1) for move in moves]
+    jobs = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        jobs.append((move.getChessNotation(), gs.packPosition()))
+        gs.unndoMove()
+    with ProcessPoolExecutor(max_workers=workers or defaultWorkers()) as pool:
+        futures = [pool.submit(_perftWorker, packed, depth - 1, generator) for notation, packed in jobs]
+        results = [(notation, future.result()) for (notation, packed), future in zip(jobs, futures)]
+    return sum(nodes for notation, nodes in results), results
+
+
+#Root splitting search: root moves are dealt round robin to the workers, each deepens on its own share
+#with its own transposition table, and the best move is taken from the deepest depth every share finished,
+#so scores are only ever compared at the same depth.
+#stopEvent is a multiprocessing.Event that ends every worker's search early once set.
+def parallelSearch(gs, timeLimit=5.0, maxDepth=64, workers=None, hashMB=16, stopEvent=None):
+    start = time.perf_counter()
+    rootMoves = gs.getValidMoves()
+    if len(rootMoves) == 0:
+        return Search.SearchResult(None, 0, 0, 0, 0.0)
+    workers = max(1, min(workers or defaultWorkers(), len(rootMoves) // 2)) #At least two moves per share
+    chunks = [[encodeMove(move) for move in rootMoves[i::workers]] for i in range(workers)]
+    packed = gs.packPosition()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(stopEvent,)) as pool:
+        futures = [pool.submit(_searchWorker, packed, chunk, maxDepth, timeLimit, hashMB) for chunk in chunks]
+        shares = [future.result() for future in futures]
+
+    completed = min(len(iterations) for iterations in shares)
+    if completed == 0: #Some share didn't finish even depth 1, fall back to the first move
+        return Search.SearchResult(rootMoves[0], 0, 0, 0, time.perf_counter() - start)
+    best = max((iterations[completed - 1] for iterations in shares), key=lambda iteration: iteration[1])
+    bestMove = next(move for move in rootMoves if encodeMove(move) == best[2])
+    nodes = sum(iterations[-1][3] for iterations in shares)
+    return Search.SearchResult(bestMove, best[1], best[0], nodes, time.perf_counter() - start)
@@ -0,0 +1,162 @@
+import argparse
+import time
+from Chess import Engine
+
+
+#Standard perft positions with their known node counts per depth (index 0 is depth 1). These are the published
+#counts: a FAIL is a move generator bug, never something to fix by editing the numbers. promotions and middlegame
+#only pass once every promotion piece is generated, not just the queen.
+POSITIONS = [
+    ("start", Engine.START_FEN,
+     (20, 400, 8902, 197281, 4865609)),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     (48, 2039, 97862, 4085603)),
+    ("endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     (14, 191, 2812, 43238, 674624)),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     (6, 264, 9467, 422333)),
+    ("middlegame", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     (44, 1486, 62379, 2103487)),
+    ("symmetric", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     (46, 2079, 89890, 3894594)),
+]
+DEFAULT_DEPTH = 3
+
+
+#GameState for a FEN string using the given move generator
+def setupPosition(fen, generator="mailbox"):
+    gs = Engine.GameState(fen)
+    gs.setGenerator(generator)
+    return gs
+
+
+#Counts the leaf nodes of the legal move tree to the given depth
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.unndoMove()
+    return nodes
+
+
+#Perft split by root move, useful for finding which move a generator bug is under
+def divide(gs, depth):
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        results.append((move.getChessNotation(), perft(gs, depth - 1)))
+        gs.unndoMove()
+    return results
+
+
+#Walks the tree with two generators side by side and returns the first position where they disagree
+def crossCheck(fen, depth, generators=("mailbox", "bitboard")):
+    states = [setupPosition(fen, generator) for generator in generators]
+    return _crossCheck(states, depth, [])
+
+
+def _crossCheck(states, depth, line):
+    moveLists = [sorted(move.getChessNotation() for move in gs.getValidMoves()) for gs in states]
+    for moves in moveLists[1:]:
+        if moves != moveLists[0]:
+            return line, moveLists
+    if depth <= 1:
+        return None
+    for move in states[0].getValidMoves():
+        for gs in states:
+            gs.makeMove(next(m for m in gs.getValidMoves() if m == move))
+        mismatch = _crossCheck(states, depth - 1, line + [move.getChessNotation()])
+        for gs in states:
+            gs.unndoMove()
+        if mismatch is not None:
+            return mismatch
+    return None
+
+
+#Runs perft over the standard positions, checking node counts and timing each one
+def runBenchmark(depth=DEFAULT_DEPTH, positions=POSITIONS, out=print, generator="mailbox"):
+    totalNodes = 0
+    totalTime = 0.0
+    failures = 0
+    for name, fen, expected in positions:
+        d = min(depth, len(expected))
+        gs = setupPosition(fen, generator)
+        start = time.perf_counter()
+        nodes = perft(gs, d)
+        elapsed = time.perf_counter() - start
+        totalNodes += nodes
+        totalTime += elapsed
+        ok = nodes == expected[d - 1]
+        if not ok:
+            failures += 1
+        out("%-12s depth %d  nodes %10d  expected %10d  %-4s  %8.3fs  %9.0f nps"
+            % (name, d, nodes, expected[d - 1], "ok" if ok else "FAIL", elapsed, nodes / max(elapsed, 1e-9)))
+    out("%-12s          nodes %10d  %33.3fs  %9.0f nps"
+        % ("total", totalNodes, totalTime, totalNodes / max(totalTime, 1e-9)))
+    if failures:
+        out("%d position(s) don't match, compare --fen FEN --divide with another engine's to find the move" % failures)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft node counts and move generation benchmark")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("--fen", help="Run perft on this position instead of the benchmark suite")
+    parser.add_argument("--divide", action="store_true", help="Print node counts per root move")
+    parser.add_argument("--generator", choices=("mailbox", "bitboard"), default="mailbox")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Split the root moves across this many processes (0 runs in this process)")
+    parser.add_argument("--crosscheck", action="store_true",
+                        help="Compare the mailbox and bitboard generators move by move instead of counting")
+    parser.add_argument("--stats", action="store_true", help="Count and time the move generator functions, printed at exit")
+    args = parser.parse_args(argv)
+
+    if args.stats:
+        from Chess import Instrument
+        Instrument.enable()
+
+    if args.crosscheck:
+        failures = 0
+        for name, fen, expected in ([("fen", args.fen, ())] if args.fen else POSITIONS):
+            mismatch = crossCheck(fen, args.depth)
+            if mismatch is None:
+                print("%-12s depth %d  generators agree" % (name, args.depth))
+            else:
+                failures += 1
+                line, moveLists = mismatch
+                print("%-12s differs after %s" % (name, " ".join(line) or "the root"))
+                for moves in moveLists:
+                    print("    " + " ".join(moves))
+        return 1 if failures else 0
+
+    if args.fen is None:
+        return 1 if runBenchmark(args.depth, generator=args.generator) else 0
+
+    gs = setupPosition(args.fen, args.generator)
+    start = time.perf_counter()
+    if args.workers > 0:
+        from Chess import Parallel
+        total, results = Parallel.parallelPerft(gs, args.depth, args.workers, args.generator)
+        if args.divide:
+            for notation, nodes in results:
+                print("%s: %d" % (notation, nodes))
+    elif args.divide:
+        total = 0
+        for notation, nodes in divide(gs, args.depth):
+            print("%s: %d" % (notation, nodes))
+            total += nodes
+    else:
+        total = perft(gs, args.depth)
+    elapsed = time.perf_counter() - start
+    print("nodes %d  time %.3fs  %.0f nps" % (total, elapsed, total / max(elapsed, 1e-9)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,277 @@
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import time
+from Chess import Analyze, Engine
+from Chess.Engine import EN_PASSANT_KEYS
+from Chess.SortedFile import findEntries
+
+
+#Index of every position reached in PGN archives: each game is replayed through GameState and one entry is kept
+#per ply, (position key, archive and byte offset of the game, ply). Entries are sorted by key in one file that
+#lookups binary search through an mmap, so a query costs a few page reads however many games are indexed.
+#
+#Building never holds more than RUN_ENTRIES entries in memory: they are sorted and spilled to temporary run
+#files, which are then merged into the index. Updating indexes only the games added since the last build
+#(new archives and the part of an archive past its indexed size) and merges them with the existing entries.
+#
+#File layout, big endian: header, then per archive (indexed size, path length, path relative to the index),
+#then the entries.
+
+MAGIC = b"CGPI"
+VERSION = 1
+HEADER = struct.Struct(">4sHHQ") #Magic, version, archive count, entry count
+ARCHIVE = struct.Struct(">QH") #Bytes of the archive that are indexed, length of the path that follows
+ENTRY = struct.Struct(">QQH") #Position key, archive << 48 | offset of the game, ply
+OFFSET_BITS = 48
+RUN_ENTRIES = 1 << 20
+WRITE_ENTRIES = 1 << 16 #Entries packed per write while merging
+
+
+#The engine's zobrist key, leaving out the en passant file when no pawn can take en passant, so a position
+#has the same key however it was reached and whatever a FEN says about en passant
+def positionKey(gs):
+    if gs.enPassantSq != () and not gs.enPassantCapturable():
+        return gs.zobristKey ^ EN_PASSANT_KEYS[gs.enPassantSq[1]]
+    return gs.zobristKey
+
+
+#Position keys of a game from the start position on, stopping early at a move that can't be read or played.
+#A game whose start position can't be set up has no keys at all.
+def gameKeys(gs, tags, movetext):
+    keys = []
+    try:
+        gs.loadFen(tags.get("FEN", Engine.START_FEN))
+        keys.append(positionKey(gs))
+        for san in Analyze.sanMoves(movetext):
+            gs.makeMove(Analyze.findSanMove(gs, san, gs.getValidMoves()))
+            keys.append(positionKey(gs))
+    except (Analyze.AnalysisError, ValueError):
+        return keys, False
+    return keys, True
+
+
+class IndexBuilder():
+    def __init__(self, directory):
+        self.directory = directory
+        self.runs = []
+        self.entries = []
+        self.count = 0
+        self.games = 0
+        self.badGames = 0
+        self.skippedGames = 0
+        self.gs = Engine.GameState()
+        self.gs.enableMoveCache(1 << 16) #Games share their openings, so most early move lists are cached
+
+
+    def addArchive(self, archive, path, start=0):
+        with open(path, "rb") as f:
+            f.seek(start)
+            for offset, tags, movetext in Analyze.readGames(f, start):
+                keys, complete = gameKeys(self.gs, tags, movetext)
+                location = archive << OFFSET_BITS | offset
+                for ply, key in enumerate(keys):
+                    self.entries.append((key, location, ply))
+                self.games += 1
+                if not keys:
+                    self.skippedGames += 1
+                elif not complete:
+                    self.badGames += 1
+                if len(self.entries) >= RUN_ENTRIES:
+                    self.spill()
+            return f.seek(0, os.SEEK_END)
+
+
+    #Sorts what's in memory into a run file
+    def spill(self):
+        if not self.entries:
+            return
+        self.entries.sort()
+        handle, path = tempfile.mkstemp(suffix=".run", dir=self.directory)
+        with os.fdopen(handle, "wb") as f:
+            for i in range(0, len(self.entries), WRITE_ENTRIES):
+                f.write(b"".join(ENTRY.pack(*entry) for entry in self.entries[i:i + WRITE_ENTRIES]))
+        self.runs.append(path)
+        self.count += len(self.entries)
+        self.entries = []
+
+
+    #Merges the runs and any existing sorted entries into path + ".tmp", for the caller to move over the index
+    #once nothing has the old one open any more
+    def write(self, path, archives, existing=None, existingCount=0):
+        self.spill()
+        files = []
+        try:
+            sources = [ENTRY.iter_unpack(existing)] if existingCount else []
+            for run in self.runs:
+                f = open(run, "rb")
+                files.append(f)
+                if os.fstat(f.fileno()).st_size:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    files.append(data)
+                    sources.append(ENTRY.iter_unpack(data))
+            indexDir = os.path.dirname(os.path.abspath(path))
+            with open(path + ".tmp", "wb") as out:
+                out.write(HEADER.pack(MAGIC, VERSION, len(archives), existingCount + self.count))
+                for archivePath, size in archives:
+                    name = os.path.relpath(os.path.abspath(archivePath), indexDir).encode("utf-8")
+                    out.write(ARCHIVE.pack(size, len(name)) + name)
+                batch = []
+                for entry in heapq.merge(*sources):
+                    batch.append(ENTRY.pack(*entry))
+                    if len(batch) >= WRITE_ENTRIES:
+                        out.write(b"".join(batch))
+                        batch = []
+                out.write(b"".join(batch))
+        finally:
+            for f in reversed(files):
+                f.close()
+            for run in self.runs:
+                os.remove(run)
+            self.runs = []
+
+
+class PositionIndex():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, archiveCount, self.entries = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("Not a position index: " + path)
+        indexDir = os.path.dirname(os.path.abspath(path))
+        self.archives = [] #(path, indexed bytes)
+        pos = HEADER.size
+        for i in range(archiveCount):
+            size, length = ARCHIVE.unpack_from(self.data, pos)
+            name = self.data[pos + ARCHIVE.size:pos + ARCHIVE.size + length].decode("utf-8")
+            self.archives.append((os.path.normpath(os.path.join(indexDir, name)), size))
+            pos += ARCHIVE.size + length
+        self.start = pos
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+    def __len__(self):
+        return self.entries
+
+
+    #(archive path, game offset, ply) for every time the position with this key was reached
+    def lookup(self, key):
+        return [(self.archives[location >> OFFSET_BITS][0], location & ((1 << OFFSET_BITS) - 1), ply)
+                for entryKey, location, ply in findEntries(self.data, key, ENTRY, self.entries, self.start)]
+
+
+    def findPosition(self, gs):
+        return self.lookup(positionKey(gs))
+
+
+    def findFen(self, fen):
+        return self.findPosition(Engine.GameState(fen))
+
+
+    #Entries as a memoryview, for merging into a rebuilt index
+    def entryData(self):
+        return memoryview(self.data)[self.start:self.start + self.entries * ENTRY.size]
+
+
+#(tags, movetext) of the game starting at offset in an archive
+def readGame(path, offset):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for start, tags, movetext in Analyze.readGames(f, offset):
+            return tags, movetext
+    return {}, ""
+
+
+def buildIndex(path, archives, out=print):
+    started = time.perf_counter()
+    builder = IndexBuilder(os.path.dirname(os.path.abspath(path)))
+    sizes = []
+    for i, archive in enumerate(archives):
+        sizes.append((archive, builder.addArchive(i, archive)))
+    builder.write(path, sizes)
+    os.replace(path + ".tmp", path)
+    _report(out, builder, started)
+
+
+#Adds the games written since the index was built: new archives in full, known ones from their indexed size on
+def updateIndex(path, archives=(), out=print):
+    if not os.path.exists(path):
+        return buildIndex(path, list(archives), out)
+    started = time.perf_counter()
+    builder = IndexBuilder(os.path.dirname(os.path.abspath(path)))
+    with PositionIndex(path) as index:
+        known = list(index.archives)
+        for archive in archives:
+            if os.path.abspath(archive) not in [os.path.abspath(knownPath) for knownPath, size in known]:
+                known.append((archive, 0))
+        if len(known) >= 1 << (64 - OFFSET_BITS):
+            raise ValueError("too many archives in one index")
+        sizes = []
+        for i, (archive, indexed) in enumerate(known):
+            if os.path.getsize(archive) < indexed:
+                raise ValueError("%s is shorter than when it was indexed, rebuild the index" % archive)
+            sizes.append((archive, builder.addArchive(i, archive, indexed)))
+        data = index.entryData()
+        try:
+            builder.write(path, sizes, data, len(index))
+        finally:
+            data.release()
+    os.replace(path + ".tmp", path)
+    _report(out, builder, started)
+
+
+def _report(out, builder, started):
+    if out is not None:
+        out("%d games, %d positions indexed in %.1fs, %d games stopped at a bad move, %d skipped for a bad start position"
+            % (builder.games, builder.count, time.perf_counter() - started, builder.badGames, builder.skippedGames))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an index of the positions reached in PGN archives")
+    parser.add_argument("index", help="Index file")
+    parser.add_argument("--build", nargs="+", metavar="PGN", help="Index these archives from scratch")
+    parser.add_argument("--update", nargs="*", metavar="PGN",
+                        help="Index games appended to the indexed archives since the last build, and these new archives")
+    parser.add_argument("--fen", help="List the games that reach this position")
+    parser.add_argument("--limit", type=int, default=20, help="Most games to list")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.build:
+            buildIndex(args.index, args.build)
+        elif args.update is not None:
+            updateIndex(args.index, args.update)
+        if args.fen:
+            with PositionIndex(args.index) as index:
+                start = time.perf_counter()
+                found = index.findFen(args.fen)
+                elapsed = time.perf_counter() - start
+                print("%d hits in %.2fms" % (len(found), elapsed * 1000))
+                for archive, offset, ply in found[:args.limit]:
+                    tags, movetext = readGame(archive, offset)
+                    print("%s:%d ply %d  %s - %s  %s" % (archive, offset, ply, tags.get("White", "?"),
+                                                        tags.get("Black", "?"), tags.get("Result", "*")))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,311 @@
+import argparse
+import time
+from Chess.Engine import EMPTY, QUEEN, TYPE_MASK, START_FEN, GameState
+from Chess.Transposition import TranspositionTable, EXACT, LOWER, UPPER, encodeMove
+from Chess.Tablebase import WIN, LOSS
+
+
+PIECE_VALUES = (0, 100, 320, 330, 500, 900, 20000) #Indexed by piece type, king only matters for MVV-LVA
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 128
+TIME_CHECK_NODES = 256 #How often the clock and the stop event are read
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+#Mate scores are stored relative to the node so they stay correct when reached from another ply
+def scoreToTable(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+#Result of one search call, bestMove is None only when the side to move has no legal moves
+class SearchResult():
+    def __init__(self, bestMove, score, depth, nodes, elapsed):
+        self.bestMove = bestMove
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    def nps(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+
+#Negamax alpha-beta with iterative deepening, quiescence on captures and a hard time budget
+class Searcher():
+    def __init__(self, hashMB=16, book=None, tablebase=None):
+        self.tt = TranspositionTable(hashMB)
+        self.book = book #Optional Book.OpeningBook, played from before searching
+        self.tablebase = tablebase #Optional Tablebase.Tablebases, exact scores for the endgames it covers
+        self.stopEvent = None #Optional threading/multiprocessing Event, setting it ends the search like a timeout
+        self.nodes = 0
+        self.deadline = None
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        self.history = [[0] * 64 for code in range(32)] #history[pieceCode][endIndex]
+        self.rootBest = None
+        self.rootLength = 0
+        self.rootFilter = None #Set of packed root moves to restrict the search to, used for root splitting
+
+
+    def evaluate(self, gs):
+        return gs.evaluate() #Kept incrementally by makeMove, no board scan per leaf
+
+
+    #Tablebase result turned into a search score, mates counted from the root like the ones the search finds
+    def tablebaseScore(self, result, plies, ply):
+        if result == WIN:
+            return MATE_SCORE - ply - plies
+        if result == LOSS:
+            return -MATE_SCORE + ply + plies
+        return 0
+
+
+    #Captures first by most valuable victim / least valuable attacker, then killers, then history
+    def scoreMove(self, move, ply):
+        if move.takenCode != EMPTY:
+            return (1 << 20) + PIECE_VALUES[move.takenCode & TYPE_MASK] * 16 - (move.movedCode & TYPE_MASK)
+        if move.promotionType == QUEEN:
+            return 1 << 19
+        killers = self.killers[ply]
+        if move == killers[0]:
+            return 1 << 18
+        if move == killers[1]:
+            return (1 << 18) - 1
+        return self.history[move.movedCode][move.endIndex]
+
+
+    #Yields legal moves lazily in stages: hash move, captures by MVV-LVA, then quiet moves by killers and
+    #history. A cutoff stops the generator, so later stages are never generated or legality checked.
+    def stagedMoves(self, gs, ply, hashMove, info, quiets=True):
+        hashed = None
+        if hashMove:
+            hashed = gs.findMove(hashMove >> 6 & 63, hashMove & 63, info, hashMove >> 12)
+            if hashed is not None and gs.isLegal(hashed, info):
+                yield hashed
+            else:
+                hashed = None
+        for stage in (gs.getCaptureMoves, gs.getQuietMoves) if quiets else (gs.getCaptureMoves,):
+            moves = []
+            stage(moves, info)
+            moves.sort(key=lambda move: self.scoreMove(move, ply), reverse=True)
+            for move in moves:
+                if (hashed is None or not move == hashed) and gs.isLegal(move, info):
+                    yield move
+
+
+    def checkTime(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            raise SearchTimeout()
+
+
+    #Captures only, except in check where every evasion is searched and standing pat isn't allowed
+    def quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0:
+            self.checkTime()
+        info = gs.getLegalityInfo()
+        inCheck = info[0]
+        if not inCheck:
+            standPat = self.evaluate(gs)
+            if standPat >= beta or ply >= MAX_PLY - 1:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+        searched = 0
+        for move in self.stagedMoves(gs, ply, 0, info, quiets=inCheck):
+            searched += 1
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.unndoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        if inCheck and searched == 0:
+            return -MATE_SCORE + ply
+        return alpha
+
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0:
+            self.checkTime()
+
+        if self.tablebase is not None and ply > 0:
+            found = self.tablebase.probe(gs)
+            if found is not None:
+                return self.tablebaseScore(found[0], found[1], ply)
+
+        key = gs.zobristKey
+        alphaOrig = alpha
+        hashMove = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttDepth, ttScore, ttBound, hashMove = entry
+            if ply > 0 and ttDepth >= depth:
+                ttScore = scoreFromTable(ttScore, ply)
+                if ttBound == EXACT or (ttBound == LOWER and ttScore >= beta) or (ttBound == UPPER and ttScore <= alpha):
+                    return ttScore
+        if ply == 0 and self.rootBest is not None:
+            hashMove = encodeMove(self.rootBest)
+
+        info = gs.getLegalityInfo()
+        rootFilter = self.rootFilter if ply == 0 else None
+        bestScore = -INFINITY
+        bestMove = None
+        for move in self.stagedMoves(gs, ply, hashMove, info):
+            if rootFilter is not None and encodeMove(move) not in rootFilter:
+                continue
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.unndoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if ply == 0:
+                    self.rootBest = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if move.takenCode == EMPTY:
+                    killers = self.killers[ply]
+                    if not move == killers[0]:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[move.movedCode][move.endIndex] += depth * depth
+                break
+
+        if bestMove is None: #No legal moves
+            return -MATE_SCORE + ply if info[0] else 0
+        if bestScore <= alphaOrig:
+            bound = UPPER
+        elif bestScore >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, scoreToTable(bestScore, ply), bound, encodeMove(bestMove))
+        return bestScore
+
+
+    #Deepens one ply at a time until maxDepth or the time budget runs out, keeping the last finished iteration
+    def search(self, gs, maxDepth=64, timeLimit=None, info=None, rootFilter=None):
+        start = time.perf_counter()
+        if self.book is not None and rootFilter is None:
+            bookMove = self.book.chooseMove(gs)
+            if bookMove is not None: #Still in book, depth 0 marks a result that wasn't searched
+                return SearchResult(bookMove, 0, 0, 0, time.perf_counter() - start)
+        if self.tablebase is not None and rootFilter is None:
+            found = self.tablebase.bestMove(gs)
+            if found is not None: #Perfect play straight from the tables, no move at all if the game is over
+                move, (result, plies) = found
+                return SearchResult(move, self.tablebaseScore(result, plies, 0), 0, 0, time.perf_counter() - start)
+        self.nodes = 0
+        self.deadline = start + timeLimit if timeLimit is not None else None
+        self.rootBest = None
+        self.rootLength = len(gs.moveLog)
+        self.rootFilter = rootFilter
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        savedFlags = (gs.inCheck, gs.checkMate, gs.staleMate)
+        result = SearchResult(None, 0, 0, 0, 0.0)
+        try:
+            rootMoves = gs.getValidMoves()
+            if rootFilter is not None:
+                rootMoves = [move for move in rootMoves if encodeMove(move) in rootFilter]
+            if rootMoves:
+                result.bestMove = rootMoves[0]
+            for depth in range(1, maxDepth + 1):
+                try:
+                    score = self.negamax(gs, depth, -INFINITY, INFINITY, 0)
+                except SearchTimeout:
+                    break
+                result = SearchResult(self.rootBest, score, depth, self.nodes, time.perf_counter() - start)
+                if info is not None:
+                    info(result)
+                #A lone move is only forced when the whole root is searched, a share of a split root keeps deepening
+                if abs(score) >= MATE_SCORE - MAX_PLY or (len(rootMoves) <= 1 and rootFilter is None):
+                    break
+        finally:
+            gs.inCheck, gs.checkMate, gs.staleMate = savedFlags
+            #A timeout unwinds mid-line, take back whatever was still on the board
+            while len(gs.moveLog) > self.rootLength:
+                gs.unndoMove()
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+
+#Convenience wrapper for the game loop, pass the same searcher each move to keep its table
+def findBestMove(gs, timeLimit=1.0, maxDepth=64, searcher=None):
+    if searcher is None:
+        searcher = Searcher()
+    return searcher.search(gs, maxDepth, timeLimit).bestMove
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless alpha-beta search")
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--depth", type=int, default=64)
+    parser.add_argument("--time", type=float, default=5.0, help="Time budget in seconds")
+    parser.add_argument("--hash", type=int, default=16, help="Transposition table size in MB")
+    parser.add_argument("--book", help="Polyglot opening book to play from before searching")
+    parser.add_argument("--tablebases", help="Directory of KQK/KRK tables built by Chess.Tablebase")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Split the root moves across this many processes (0 searches in this process)")
+    args = parser.parse_args(argv)
+
+    gs = GameState(args.fen)
+    if args.book:
+        from Chess import Book
+        with Book.OpeningBook(args.book) as book:
+            bookMove = book.chooseMove(gs)
+        if bookMove is not None:
+            print("bookmove %s" % bookMove.getChessNotation())
+            return 0
+    if args.workers > 0:
+        from Chess import Parallel
+        result = Parallel.parallelSearch(gs, args.time, args.depth, args.workers, args.hash)
+        print("bestmove %s  depth %d  score %d  nodes %d  %.0f nps"
+              % (result.bestMove.getChessNotation() if result.bestMove else "(none)", result.depth, result.score,
+                 result.nodes, result.nps()))
+        return 0
+
+    def info(result):
+        print("depth %2d  score %6d  nodes %9d  time %7.3fs  %8.0f nps  best %s"
+              % (result.depth, result.score, result.nodes, result.elapsed, result.nps(),
+                 result.bestMove.getChessNotation() if result.bestMove else "-"))
+
+    tablebase = None
+    if args.tablebases:
+        from Chess import Tablebase
+        tablebase = Tablebase.Tablebases(args.tablebases)
+    searcher = Searcher(args.hash, tablebase=tablebase)
+    result = searcher.search(gs, args.depth, args.time, info)
+    print("bestmove %s  depth %d  nodes %d  %.0f nps"
+          % (result.bestMove.getChessNotation() if result.bestMove else "(none)", result.depth, result.nodes, result.nps()))
+    stats = searcher.tt.stats()
+    print("hash %dMB  %d entries  hit rate %.1f%%  fill %.1f%%"
+          % (stats["sizeMB"], stats["entries"], stats["hitRate"] * 100, stats["fill"] * 100))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
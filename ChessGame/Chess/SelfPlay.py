@@ -0,0 +1,334 @@
+import argparse
+import json
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from Chess import Analyze, Engine, Search
+from Chess.Engine import EMPTY, KNIGHT, BISHOP, KING, TYPE_MASK
+from Chess.Parallel import defaultWorkers
+
+
+#Plays many games between two players in a pool of worker processes. Games are handed out a few at a time
+#and written to the output as soon as each one finishes, so memory stays flat however long the run is.
+#A worker process that dies takes its pool with it: the pool is rebuilt and the games it was playing are
+#played again one at a time, so a crash can be put down to the game that caused it. Only a game that crashes
+#while running alone uses up an attempt, and it is written as an error after MAX_ATTEMPTS of those.
+#
+#Players are given as "random", "greedy" (best static evaluation one ply ahead) or "search" with options,
+#for example "search:depth=3" or "search:time=0.1,hash=4".
+
+PLAYER_OPTIONS = {"random": (), "greedy": (), "search": ("depth", "time", "hash")}
+MAX_ATTEMPTS = 3
+IN_FLIGHT_PER_WORKER = 2 #Games queued per worker process, enough to keep them busy
+REPORT_SECONDS = 5.0
+RESULTS = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+
+
+#(kind, options) for a player string, raises ValueError for anything unknown
+def parsePlayer(spec):
+    kind, _, optionText = spec.partition(":")
+    if kind not in PLAYER_OPTIONS:
+        raise ValueError("unknown player " + kind)
+    options = {}
+    for item in filter(None, optionText.split(",")):
+        name, _, value = item.partition("=")
+        if name not in PLAYER_OPTIONS[kind]:
+            raise ValueError("unknown option %s for %s" % (name, kind))
+        options[name] = float(value) if name == "time" else int(value)
+    if kind == "search" and "depth" not in options and "time" not in options:
+        options["depth"] = 2
+    return kind, options
+
+
+class RandomPlayer():
+    def __init__(self, rng):
+        self.rng = rng
+
+
+    def chooseMove(self, gs, moves):
+        return self.rng.choice(moves)
+
+
+class GreedyPlayer():
+    def __init__(self, rng):
+        self.rng = rng
+
+
+    def chooseMove(self, gs, moves):
+        best = []
+        bestScore = None
+        for move in moves:
+            gs.makeMove(move)
+            score = -gs.evaluate()
+            gs.unndoMove()
+            if bestScore is None or score > bestScore:
+                best, bestScore = [move], score
+            elif score == bestScore:
+                best.append(move)
+        return self.rng.choice(best)
+
+
+class SearchPlayer():
+    def __init__(self, depth=Search.MAX_PLY - 1, time=None, hash=16):
+        self.searcher = Search.Searcher(hash)
+        self.depth = depth
+        self.time = time
+
+
+    def chooseMove(self, gs, moves):
+        return self.searcher.search(gs, self.depth, self.time).bestMove or moves[0]
+
+
+def makePlayer(spec, rng):
+    kind, options = parsePlayer(spec)
+    if kind == "random":
+        return RandomPlayer(rng)
+    if kind == "greedy":
+        return GreedyPlayer(rng)
+    return SearchPlayer(**options)
+
+
+#Bare kings, or a lone knight or bishop against a bare king
+def insufficientMaterial(gs):
+    pieces = [piece & TYPE_MASK for piece in gs.squares if piece != EMPTY and piece & TYPE_MASK != KING]
+    return not pieces or (len(pieces) == 1 and pieces[0] in (KNIGHT, BISHOP))
+
+
+#Plays one game and returns its record. The first openingPlies moves are random so repeated pairings differ.
+def playGame(index, white, black, seed, startFen=Engine.START_FEN, openingPlies=4, maxPlies=400, san=False):
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    gs = Engine.GameState(startFen)
+    players = (makePlayer(white, rng), makePlayer(black, rng))
+    seen = {gs.zobristKey: 1}
+    moveList = []
+    sanList = []
+    result, termination = "1/2-1/2", "max plies"
+    for ply in range(maxPlies):
+        moves = gs.getValidMoves()
+        if not moves:
+            if gs.inCheck:
+                result, termination = ("0-1" if gs.whiteTurn else "1-0"), "checkmate"
+            else:
+                termination = "stalemate"
+            break
+        if gs.halfmoveClock >= 100:
+            termination = "fifty moves"
+            break
+        if insufficientMaterial(gs):
+            termination = "insufficient material"
+            break
+        if ply < openingPlies:
+            move = rng.choice(moves)
+        else:
+            move = players[0 if gs.whiteTurn else 1].chooseMove(gs, moves)
+        if san:
+            sanList.append(Analyze.moveToSan(gs, move, moves))
+        moveList.append(move.getChessNotation())
+        gs.makeMove(move)
+        seen[gs.zobristKey] = seen.get(gs.zobristKey, 0) + 1
+        if seen[gs.zobristKey] >= 3:
+            termination = "threefold repetition"
+            break
+    record = {"game": index, "white": white, "black": black, "result": result, "termination": termination,
+              "plies": len(moveList), "fen": startFen, "moves": moveList, "seconds": time.perf_counter() - start}
+    if san:
+        record["san"] = sanList
+    return record
+
+
+def formatPgn(record):
+    tags = [("Event", "Self-play"), ("Round", str(record["game"] + 1)), ("White", record["white"]),
+            ("Black", record["black"]), ("Result", record.get("result", "*"))]
+    if record["fen"] != Engine.START_FEN:
+        tags += [("SetUp", "1"), ("FEN", record["fen"])]
+    tags += [("PlyCount", str(record.get("plies", 0))), ("Termination", record.get("termination", record.get("error")))]
+    lines = ['[%s "%s"]' % (name, str(value).replace('"', "'")) for name, value in tags]
+    fields = record["fen"].split()
+    whiteTurn = fields[1] == "w"
+    number = int(fields[5]) if len(fields) > 5 else 1
+    tokens = []
+    for san in record.get("san", ()):
+        if whiteTurn:
+            tokens.append("%d." % number)
+        elif not tokens:
+            tokens.append("%d..." % number)
+        tokens.append(san)
+        if not whiteTurn:
+            number += 1
+        whiteTurn = not whiteTurn
+    tokens.append(record.get("result", "*"))
+    movetext = []
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            movetext.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    movetext.append(line)
+    return "\n".join(lines) + "\n\n" + "\n".join(movetext) + "\n\n"
+
+
+class SelfPlayRunner():
+    def __init__(self, playerA, playerB, games, out, fmt="jsonl", workers=None, seed=0, startFen=Engine.START_FEN,
+                 openingPlies=4, maxPlies=400, log=sys.stderr):
+        parsePlayer(playerA)
+        parsePlayer(playerB)
+        self.players = (playerA, playerB)
+        self.games = games
+        self.out = out
+        self.fmt = fmt
+        self.workers = workers or defaultWorkers()
+        self.seed = seed
+        self.startFen = startFen
+        self.openingPlies = openingPlies
+        self.maxPlies = maxPlies
+        self.log = log
+        self.finished = 0
+        self.positions = 0
+        self.errors = 0
+        self.restarts = 0
+        self.score = [0, 0, 0] #Player A wins, draws, losses
+        self.startTime = None
+        self.lastReport = None
+
+
+    #Player A has white in even games and black in odd ones
+    def submit(self, pool, index):
+        white, black = self.players if index % 2 == 0 else self.players[::-1]
+        return pool.submit(playGame, index, white, black, self.seed * 1000003 + index, self.startFen,
+                           self.openingPlies, self.maxPlies, self.fmt == "pgn")
+
+
+    def write(self, record):
+        if self.fmt == "pgn":
+            self.out.write(formatPgn(record))
+        else:
+            self.out.write(json.dumps(record) + "\n")
+        self.out.flush()
+        self.finished += 1
+        if "error" in record:
+            self.errors += 1
+            return
+        self.positions += record["plies"] + 1
+        if record["result"] in RESULTS:
+            points = RESULTS[record["result"]] if record["game"] % 2 == 0 else 1 - RESULTS[record["result"]]
+            self.score[0 if points == 1 else 1 if points == 0.5 else 2] += 1
+
+
+    def rates(self):
+        elapsed = max(time.perf_counter() - self.startTime, 1e-9)
+        return self.finished / elapsed, self.positions / elapsed
+
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if self.log is None or (not force and now - self.lastReport < REPORT_SECONDS):
+            return
+        self.lastReport = now
+        gamesPerSecond, positionsPerSecond = self.rates()
+        self.log.write("games %d/%d  %.2f games/s  %.0f positions/s  A +%d =%d -%d  errors %d  restarts %d\n"
+                       % (self.finished, self.games, gamesPerSecond, positionsPerSecond, self.score[0], self.score[1],
+                          self.score[2], self.errors, self.restarts))
+        self.log.flush()
+
+
+    def run(self):
+        self.startTime = self.lastReport = time.perf_counter()
+        suspects = deque() #(index, attempts) of games in flight when a worker died, played again one at a time
+        nextGame = 0
+        pending = {} #Future -> (index, attempts)
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            while nextGame < self.games or suspects or pending:
+                if suspects:
+                    if not pending:
+                        index, attempts = suspects.popleft()
+                        pending[self.submit(pool, index)] = (index, attempts)
+                else:
+                    while len(pending) < self.workers * IN_FLIGHT_PER_WORKER and nextGame < self.games:
+                        pending[self.submit(pool, nextGame)] = (nextGame, 0)
+                        nextGame += 1
+                alone = len(pending) == 1
+                done, _ = wait(pending, timeout=REPORT_SECONDS, return_when=FIRST_COMPLETED)
+                lost = [] #Games that went down with a broken pool
+                for future in done:
+                    index, attempts = pending.pop(future)
+                    try:
+                        record = future.result()
+                    except BrokenProcessPool:
+                        lost.append((index, attempts))
+                        continue
+                    except Exception as e: #The game itself failed, playing it again would fail the same way
+                        record = self.errorRecord(index, repr(e))
+                    self.write(record)
+                if lost:
+                    #Everything still in flight went down with the pool. A game that was running alone crashed it,
+                    #any others are played again one at a time without using up an attempt.
+                    lost += pending.values()
+                    if alone:
+                        self.retry(suspects, *lost[0])
+                    else:
+                        suspects.extend(lost)
+                    pending = {}
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = ProcessPoolExecutor(max_workers=self.workers)
+                    self.restarts += 1
+                self.report()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.report(force=True)
+        return self.finished
+
+
+    def retry(self, suspects, index, attempts):
+        if attempts + 1 < MAX_ATTEMPTS:
+            suspects.append((index, attempts + 1))
+        else:
+            self.write(self.errorRecord(index, "worker process crashed"))
+
+
+    def errorRecord(self, index, error):
+        return {"game": index, "white": self.players[index % 2], "black": self.players[1 - index % 2],
+                "fen": self.startFen, "error": error}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play games between two players in parallel, streaming each one out as it ends")
+    parser.add_argument("playerA", help="random, greedy or search[:depth=N,time=S,hash=MB]")
+    parser.add_argument("playerB")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--out", default="-", help="File to write, - for stdout (the default)")
+    parser.add_argument("--append", action="store_true", help="Add to the end of --out instead of replacing it")
+    parser.add_argument("--format", choices=("jsonl", "pgn"), help="Defaults to pgn for a .pgn file, else jsonl")
+    parser.add_argument("--workers", type=int, help="Worker processes, defaults to the CPU count")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fen", default=Engine.START_FEN, help="Start every game from this position")
+    parser.add_argument("--opening-plies", type=int, default=4, help="Random moves played before the players take over")
+    parser.add_argument("--max-plies", type=int, default=400, help="Games still going after this many plies are drawn")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("pgn" if args.out.endswith(".pgn") else "jsonl")
+    try:
+        Engine.GameState(args.fen)
+        out = sys.stdout if args.out == "-" else open(args.out, "a" if args.append else "w", encoding="utf-8")
+        runner = SelfPlayRunner(args.playerA, args.playerB, args.games, out, fmt, args.workers, args.seed, args.fen,
+                                args.opening_plies, args.max_plies)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    try:
+        runner.run()
+    except BrokenPipeError: #Output piped into head and closed early
+        sys.stderr.close()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if runner.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,26 @@
+import struct
+
+
+#Lookups in files of fixed size records sorted by a leading big endian 64 bit key, such as Polyglot books and
+#position indexes. The records are searched in place, data is normally an mmap of the file.
+KEY = struct.Struct(">Q")
+
+
+#Records whose key matches, found by binary search. There are count records of the struct entry, starting
+#start bytes into data.
+def findEntries(data, key, entry, count, start=0):
+    low, high = 0, count
+    while low < high: #First entry with a key >= the one asked for
+        mid = (low + high) // 2
+        if KEY.unpack_from(data, start + mid * entry.size)[0] < key:
+            low = mid + 1
+        else:
+            high = mid
+    found = []
+    while low < count:
+        values = entry.unpack_from(data, start + low * entry.size)
+        if values[0] != key:
+            break
+        found.append(values)
+        low += 1
+    return found
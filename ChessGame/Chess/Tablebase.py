@@ -0,0 +1,292 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from Chess.Engine import (EMPTY, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, COLOR_MASK, TYPE_MASK, RAYS,
+                          KING_SQUARES, SLIDER_DIRECTIONS, GameState)
+
+
+#Distance to mate tables for king and queen or rook against a lone king, built by retrograde analysis and
+#stored on disk as zlib compressed blocks. Probes only decompress the block they need and keep the most
+#recently used blocks in memory.
+#
+#A table holds every placement of strong king, piece and weak king, index (strongKing * 64 + piece) * 64 + weakKing,
+#once with the weak side to move and once with the strong side to move. A byte is plies to mate + 1, 0 for a
+#draw or a placement that can't happen. Without pawns colors don't matter, so one table covers both.
+
+TABLES = {"KQK": QUEEN, "KRK": ROOK}
+MAGIC = b"CGTB"
+HEADER = struct.Struct(">4sII") #Magic, block size, block count
+BLOCK_SIZE = 4096
+POSITIONS = 64 * 64 * 64
+WIN, DRAW, LOSS = 1, 0, -1
+
+
+def _buildLines(directions):
+    lines = [[None] * 64 for sq in range(64)]
+    for sq in range(64):
+        for d in directions:
+            between = ()
+            for target in RAYS[sq][d]:
+                lines[sq][target] = between
+                between += (target,)
+    return lines
+
+
+#LINES[pieceType][sq][target] is the squares in between when the piece on sq moves along a line to target, else None
+LINES = {pieceType: _buildLines(SLIDER_DIRECTIONS[pieceType]) for pieceType in TABLES.values()}
+ADJACENT = [[False] * 64 for sq in range(64)]
+for _sq in range(64):
+    for _target in KING_SQUARES[_sq]:
+        ADJACENT[_sq][_target] = True
+
+
+def _attacks(line, blocker):
+    return line is not None and blocker not in line
+
+
+def buildTable(pieceType):
+    lines = LINES[pieceType]
+    directions = SLIDER_DIRECTIONS[pieceType]
+    weakToMove = bytearray(POSITIONS)
+    strongToMove = bytearray(POSITIONS)
+    moveCounts = bytearray(POSITIONS) #Weak king moves not yet known to lose, per weak to move placement
+    frontier = []
+
+    for strong in range(64):
+        for piece in range(64):
+            if piece == strong:
+                continue
+            pieceLines = lines[piece]
+            for weak in range(64):
+                if weak == strong or weak == piece or ADJACENT[strong][weak]:
+                    continue
+                count = 0
+                for target in KING_SQUARES[weak]:
+                    if target == strong or ADJACENT[strong][target]:
+                        continue
+                    if target == piece or not _attacks(pieceLines[target], strong):
+                        count += 1
+                index = (strong * 64 + piece) * 64 + weak
+                moveCounts[index] = count
+                if count == 0 and _attacks(pieceLines[weak], strong):
+                    weakToMove[index] = 1 #Mated, 0 plies to go
+                    frontier.append(index)
+
+    plies = 0
+    while frontier:
+        #Every strong move into a lost position wins one ply later
+        won = []
+        for index in frontier:
+            weak = index & 63
+            piece = index >> 6 & 63
+            strong = index >> 12
+            for origin in KING_SQUARES[strong]:
+                if origin != piece and origin != weak and not ADJACENT[origin][weak] \
+                        and not _attacks(lines[piece][weak], origin):
+                    before = (origin * 64 + piece) * 64 + weak
+                    if not strongToMove[before]:
+                        strongToMove[before] = plies + 2
+                        won.append(before)
+            for d in directions:
+                for origin in RAYS[piece][d]:
+                    if origin == strong or origin == weak:
+                        break
+                    if not _attacks(lines[origin][weak], strong):
+                        before = (strong * 64 + origin) * 64 + weak
+                        if not strongToMove[before]:
+                            strongToMove[before] = plies + 2
+                            won.append(before)
+        #A weak position is lost once every king move out of it walks into a won one
+        frontier = []
+        for index in won:
+            weak = index & 63
+            piece = index >> 6 & 63
+            strong = index >> 12
+            base = (strong * 64 + piece) * 64
+            for origin in KING_SQUARES[weak]:
+                if origin == strong or origin == piece or ADJACENT[strong][origin]:
+                    continue
+                before = base + origin
+                if not weakToMove[before]:
+                    moveCounts[before] -= 1
+                    if moveCounts[before] == 0:
+                        weakToMove[before] = plies + 3
+                        frontier.append(before)
+        plies += 2
+    return bytes(weakToMove + strongToMove)
+
+
+def writeTable(path, data, blockSize=BLOCK_SIZE):
+    blocks = [zlib.compress(data[i:i + blockSize], 9) for i in range(0, len(data), blockSize)]
+    offsets = [0]
+    for block in blocks:
+        offsets.append(offsets[-1] + len(block))
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, blockSize, len(blocks)))
+        f.write(struct.pack(">%dI" % len(offsets), *offsets))
+        for block in blocks:
+            f.write(block)
+
+
+#Builds every table into directory, skipping the ones already there unless force is set
+def buildTables(directory, force=False, out=print):
+    os.makedirs(directory, exist_ok=True)
+    for name, pieceType in TABLES.items():
+        path = os.path.join(directory, name + ".cgtb")
+        if os.path.exists(path) and not force:
+            continue
+        start = time.perf_counter()
+        writeTable(path, buildTable(pieceType))
+        out("%s built in %.1fs, %d bytes" % (name, time.perf_counter() - start, os.path.getsize(path)))
+
+
+class TableFile():
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.blockSize, blockCount = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a tablebase file: " + path)
+        self.offsets = struct.unpack_from(">%dI" % (blockCount + 1), self.data, HEADER.size)
+        self.start = HEADER.size + 4 * (blockCount + 1)
+
+
+    def readBlock(self, block):
+        return zlib.decompress(self.data[self.start + self.offsets[block]:self.start + self.offsets[block + 1]])
+
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+class Tablebases():
+    def __init__(self, directory, cacheBlocks=64):
+        self.files = {}
+        for name in TABLES:
+            path = os.path.join(directory, name + ".cgtb")
+            if os.path.exists(path):
+                self.files[TABLES[name]] = TableFile(path)
+        self.cacheBlocks = cacheBlocks
+        self.blocks = OrderedDict() #(pieceType, block) -> decompressed bytes, least recently used first
+        self.probes = 0
+        self.hits = 0
+        self.blockReads = 0
+
+
+    def close(self):
+        for table in self.files.values():
+            table.close()
+        self.files = {}
+        self.blocks.clear()
+
+
+    def readValue(self, pieceType, offset):
+        table = self.files[pieceType]
+        key = (pieceType, offset // table.blockSize)
+        block = self.blocks.get(key)
+        if block is None:
+            self.blockReads += 1
+            block = self.blocks[key] = table.readBlock(key[1])
+            if len(self.blocks) > self.cacheBlocks:
+                self.blocks.popitem(last=False)
+        else:
+            self.blocks.move_to_end(key)
+        return block[offset % table.blockSize]
+
+
+    #(WIN/DRAW/LOSS for the side to move, plies to mate) or None when the position isn't covered
+    def probe(self, gs):
+        squares = gs.squares
+        empty = squares.count(EMPTY)
+        if empty < 61:
+            return None
+        self.probes += 1
+        if empty == 62: #Two bare kings
+            self.hits += 1
+            return DRAW, 0
+        for sq in range(64):
+            piece = squares[sq]
+            if piece != EMPTY and piece & TYPE_MASK != KING:
+                break
+        pieceType = piece & TYPE_MASK
+        if pieceType == KNIGHT or pieceType == BISHOP: #A minor piece alone can't mate
+            self.hits += 1
+            return DRAW, 0
+        if pieceType not in self.files or gs.currCastlingRights.toBits():
+            return None
+        strongColor = piece & COLOR_MASK
+        strongKing = gs.wKingSq if strongColor == WHITE else gs.bKingSq
+        weakKing = gs.bKingSq if strongColor == WHITE else gs.wKingSq
+        strongToMove = gs.whiteTurn == (strongColor == WHITE)
+        index = (strongKing * 64 + sq) * 64 + weakKing
+        value = self.readValue(pieceType, index + POSITIONS if strongToMove else index)
+        self.hits += 1
+        if value == 0:
+            return DRAW, 0
+        return (WIN if strongToMove else LOSS), value - 1
+
+
+    #Best legal move by the tables and its (result, plies) for the side to move, or None if not covered. The
+    #move is None when there is none to play, mate or stalemate. Wins go for the fastest mate, losses hold out
+    #for the longest.
+    def bestMove(self, gs):
+        probed = self.probe(gs)
+        if probed is None:
+            return None
+        moves = gs.getValidMoves()
+        if not moves:
+            return None, probed
+        best = None
+        bestRank = None
+        for move in moves:
+            gs.makeMove(move)
+            found = self.probe(gs)
+            gs.unndoMove()
+            if found is None:
+                continue
+            result = -found[0]
+            plies = found[1] + 1 if result != DRAW else 0
+            rank = (result, -plies if result == WIN else plies)
+            if bestRank is None or rank > bestRank:
+                best, bestRank, bestFound = move, rank, (result, plies)
+        if best is None:
+            return None
+        return best, bestFound
+
+
+    def stats(self):
+        return {"tables": sorted(name for name, pieceType in TABLES.items() if pieceType in self.files),
+                "probes": self.probes, "hits": self.hits, "blockReads": self.blockReads,
+                "cachedBlocks": len(self.blocks)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or probe the KQK/KRK endgame tables")
+    parser.add_argument("directory", help="Where the table files live")
+    parser.add_argument("--build", action="store_true", help="Generate the tables that aren't there yet")
+    parser.add_argument("--force", action="store_true", help="With --build, regenerate every table")
+    parser.add_argument("--fen", help="Probe this position")
+    args = parser.parse_args(argv)
+
+    if args.build:
+        buildTables(args.directory, args.force)
+    if args.fen:
+        tables = Tablebases(args.directory)
+        gs = GameState(args.fen)
+        found = tables.bestMove(gs)
+        if found is None:
+            print("not in the tables")
+            return 1
+        move, (result, plies) = found
+        print("%s  %s in %d plies" % (move.getChessNotation() if move is not None else "no legal moves",
+                                      {WIN: "win", DRAW: "draw", LOSS: "loss"}[result], plies))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
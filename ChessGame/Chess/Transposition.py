@@ -0,0 +1,85 @@
+from array import array
+
+
+EXACT, LOWER, UPPER = 1, 2, 3 #Bound types, 0 marks an empty slot
+ENTRY_BYTES = 16 #One 64 bit key and one 64 bit packed data word per slot
+SCORE_OFFSET = 1 << 31
+
+
+#Packs a move into 16 bits: 6 bits start square, 6 bits end square, 3 bits promotion piece type
+def encodeMove(move):
+    return move.promotionType << 12 | move.startIndex << 6 | move.endIndex
+
+
+#Fixed size table preallocated as two flat arrays. Every bucket has two slots: slot 0 keeps the
+#deepest search seen for its bucket, slot 1 is always overwritten by whatever didn't go in slot 0.
+class TranspositionTable():
+    def __init__(self, sizeMB=16):
+        self.resize(sizeMB)
+
+
+    def resize(self, sizeMB):
+        buckets = 1
+        while buckets * 2 * 2 * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+            buckets *= 2 #Power of two so the bucket index is a mask of the key
+        self.sizeMB = sizeMB
+        self.mask = buckets - 1
+        self.keys = array('Q', [0]) * (buckets * 2)
+        self.data = array('Q', [0]) * (buckets * 2)
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+
+    def clear(self):
+        self.resize(self.sizeMB)
+
+
+    #Returns (depth, score, bound, move16) or None
+    def probe(self, key):
+        self.probes += 1
+        slot = (key & self.mask) << 1
+        keys = self.keys
+        if keys[slot] != key:
+            slot += 1
+            if keys[slot] != key:
+                return None
+        self.hits += 1
+        data = self.data[slot]
+        return (data >> 24 & 0xFF, (data >> 32) - SCORE_OFFSET, data >> 16 & 0xFF, data & 0xFFFF)
+
+
+    def store(self, key, depth, score, bound, move16):
+        self.stores += 1
+        slot = (key & self.mask) << 1
+        keys = self.keys
+        data = self.data
+        depth = min(depth, 0xFF)
+        if keys[slot] == key:
+            if move16 == 0:
+                move16 = data[slot] & 0xFFFF #Keep the old best move when this search didn't find one
+        elif keys[slot] != 0 and (data[slot] >> 24 & 0xFF) > depth:
+            slot += 1 #Deeper result for another position holds the depth preferred slot
+            if move16 == 0 and keys[slot] == key:
+                move16 = data[slot] & 0xFFFF
+        elif keys[slot] != 0:
+            #Taking over the depth preferred slot, its old entry moves down to the always replace slot
+            keys[slot + 1] = keys[slot]
+            data[slot + 1] = data[slot]
+        keys[slot] = key
+        data[slot] = (score + SCORE_OFFSET) << 32 | depth << 24 | bound << 16 | move16
+
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+
+    #Fraction of slots in use, sampled over the first thousand buckets
+    def fill(self):
+        sample = min(len(self.keys), 2000)
+        return sum(1 for slot in range(sample) if self.keys[slot] != 0) / sample
+
+
+    def stats(self):
+        return {"sizeMB": self.sizeMB, "entries": len(self.keys), "probes": self.probes, "hits": self.hits,
+                "stores": self.stores, "hitRate": self.hitRate(), "fill": self.fill()}
@@ -0,0 +1,215 @@
+import sys
+import threading
+from Chess import Engine, Search
+from Chess.Parallel import defaultWorkers
+
+
+#UCI engine over stdin/stdout. Commands are read on the main thread while the search runs on a worker thread,
+#so isready and stop are answered straight away. One GameState is kept for the whole session and
+#"position ... moves" only plays or takes back the moves that differ from the last command.
+
+ENGINE_NAME = "ChessGame"
+ENGINE_AUTHOR = "RASarabia"
+DEFAULT_HASH = 16
+MAX_HASH = 1024
+MOVE_OVERHEAD = 0.05 #Seconds kept back per move for reading and writing the protocol
+DEFAULT_MOVES_TO_GO = 30
+
+
+#Seconds to spend on this move from the go parameters, None to search without a clock
+def allocateTime(params, whiteTurn):
+    if "movetime" in params:
+        return max(params["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    remaining = params.get("wtime" if whiteTurn else "btime")
+    if remaining is None:
+        return None
+    increment = params.get("winc" if whiteTurn else "binc", 0) / 1000
+    remaining /= 1000
+    budget = remaining / params.get("movestogo", DEFAULT_MOVES_TO_GO) + increment * 0.8
+    return max(min(budget, remaining / 2) - MOVE_OVERHEAD, 0.01)
+
+
+class UciServer():
+    def __init__(self, inp=sys.stdin, out=sys.stdout):
+        self.inp = inp
+        self.out = out
+        self.outLock = threading.Lock()
+        self.gs = Engine.GameState()
+        self.positionBase = Engine.START_FEN
+        self.playedMoves = [] #UCI moves played on top of positionBase
+        self.hashMB = DEFAULT_HASH
+        self.threads = 1
+        self.searcher = Search.Searcher(self.hashMB)
+        self.searchThread = None
+        self.stopEvent = None
+
+
+    def send(self, line):
+        with self.outLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+
+    def run(self):
+        for line in self.inp:
+            if not self.handle(line.strip()):
+                break
+        self.stopSearch()
+
+
+    #Returns False on quit
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" % (DEFAULT_HASH, MAX_HASH))
+            self.send("option name Threads type spin default 1 min 1 max %d" % defaultWorkers())
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.stopSearch()
+            self.setOption(args)
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.searcher = Search.Searcher(self.hashMB)
+            self.setPosition(Engine.START_FEN, [])
+        elif command == "position":
+            self.stopSearch()
+            self.position(args)
+        elif command == "go":
+            self.stopSearch()
+            self.go(args)
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            return False
+        return True
+
+
+    def setOption(self, args):
+        if "name" not in args or "value" not in args:
+            return
+        name = " ".join(args[args.index("name") + 1:args.index("value")]).lower()
+        value = " ".join(args[args.index("value") + 1:])
+        try:
+            if name == "hash":
+                self.hashMB = min(max(int(value), 1), MAX_HASH)
+                self.searcher.tt.resize(self.hashMB)
+            elif name == "threads":
+                self.threads = min(max(int(value), 1), defaultWorkers())
+        except ValueError:
+            self.send("info string bad value for " + name)
+
+
+    def position(self, args):
+        if not args:
+            return
+        moves = args[args.index("moves") + 1:] if "moves" in args else []
+        if args[0] == "startpos":
+            base = Engine.START_FEN
+        elif args[0] == "fen":
+            base = " ".join(args[1:args.index("moves")] if "moves" in args else args[1:])
+        else:
+            return
+        try:
+            self.setPosition(base, moves)
+        except ValueError as e:
+            self.send("info string " + str(e))
+
+
+    #Takes back to the last move shared with the new list and plays the rest, reloading only for a new base
+    def setPosition(self, base, moves):
+        gs = self.gs
+        if base != self.positionBase:
+            gs.loadFen(base)
+            self.positionBase = base
+            self.playedMoves = []
+        shared = 0
+        while shared < min(len(moves), len(self.playedMoves)) and moves[shared] == self.playedMoves[shared]:
+            shared += 1
+        while len(self.playedMoves) > shared:
+            gs.unndoMove()
+            self.playedMoves.pop()
+        for text in moves[shared:]:
+            self.playMove(text)
+
+
+    def playMove(self, text):
+        gs = self.gs
+        for move in gs.getValidMoves():
+            if move.getChessNotation() == text:
+                gs.makeMove(move)
+                self.playedMoves.append(text)
+                return
+        raise ValueError("illegal move " + text)
+
+
+    def go(self, args):
+        params = {}
+        infinite = "infinite" in args
+        for i, token in enumerate(args[:-1]):
+            if token in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth"):
+                try:
+                    params[token] = int(args[i + 1])
+                except ValueError:
+                    pass
+        timeLimit = None if infinite else allocateTime(params, self.gs.whiteTurn)
+        maxDepth = params.get("depth", Search.MAX_PLY - 1)
+        if self.threads > 1:
+            import multiprocessing
+            self.stopEvent = multiprocessing.Event()
+        else:
+            self.stopEvent = threading.Event()
+        self.searchThread = threading.Thread(target=self.search, args=(maxDepth, timeLimit, infinite, self.stopEvent),
+                                             daemon=True)
+        self.searchThread.start()
+
+
+    def info(self, result):
+        if abs(result.score) >= Search.MATE_SCORE - Search.MAX_PLY:
+            plies = Search.MATE_SCORE - abs(result.score)
+            score = "mate %d" % ((plies + 1) // 2 if result.score > 0 else -((plies + 1) // 2))
+        else:
+            score = "cp %d" % result.score
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s"
+                  % (result.depth, score, result.nodes, result.nps(), result.elapsed * 1000,
+                     result.bestMove.getChessNotation() if result.bestMove else ""))
+
+
+    def search(self, maxDepth, timeLimit, infinite, stopEvent):
+        try:
+            if self.threads > 1:
+                from Chess import Parallel
+                result = Parallel.parallelSearch(self.gs, timeLimit, maxDepth, self.threads, self.hashMB, stopEvent)
+                if result.bestMove is not None:
+                    self.info(result)
+            else:
+                self.searcher.stopEvent = stopEvent
+                result = self.searcher.search(self.gs, maxDepth, timeLimit, self.info)
+            if infinite: #The best move only goes out once the GUI says stop
+                stopEvent.wait()
+            self.send("bestmove " + (result.bestMove.getChessNotation() if result.bestMove else "0000"))
+        except Exception as e: #Never leave the GUI waiting on a bestmove
+            self.send("info string search failed: %r" % e)
+            self.send("bestmove 0000")
+
+
+    def stopSearch(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+
+def main(argv=None):
+    UciServer().run()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())